@@ -0,0 +1,108 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
+from smpl_parser import compileFile
+from graph_emitter import formats, DOT, JSONL, BINARY
+import ir_cache
+
+extensions = {DOT: ".dot", JSONL: ".jsonl", BINARY: ".bin"}
+
+# outcome of one source file
+class BatchResult:
+    def __init__(self, filename: str, output: str, seconds: float, error: str = None):
+        self.filename = filename
+        self.output = output
+        self.seconds = seconds
+        self.error = error
+
+    def toDict(self) -> dict:
+        return {"file": self.filename, "output": self.output, "seconds": self.seconds, "error": self.error}
+
+# files named by inputs, each one a file, a directory or a glob pattern
+# directories contribute the files matching pattern, sorted
+def expandInputs(inputs: List[str], pattern: str = "*") -> List[str]:
+    files = []
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = sorted(path for path in glob.glob(os.path.join(item, "**", pattern), recursive=True) if os.path.isfile(path))
+        elif os.path.isfile(item):
+            matches = [item]
+        else:
+            matches = sorted(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+        for path in matches:
+            path = os.path.abspath(path)
+            if path not in seen:
+                seen.add(path)
+                files.append(path)
+    return files
+
+# output paths mirror the input tree below the common directory, so equal names never collide
+def outputPaths(files: List[str], output_dir: str, format: str) -> List[str]:
+    if not files:
+        return []
+    root = os.path.commonpath([os.path.dirname(path) for path in files])
+    return [os.path.join(output_dir, os.path.relpath(path, root) + extensions[format]) for path in files]
+
+# compile one file in a worker, every compilation owns its symbols, diagnostics and output file
+def compileOne(filename: str, output: str, format: str = DOT, dominators: bool = False, cache_dir: str = None, cache_size: int = 64 << 20) -> BatchResult:
+    start = time.perf_counter()
+    try:
+        cache = ir_cache.IRCache(cache_dir, max_bytes=cache_size) if cache_dir else None
+        ir = compileFile(filename, cache=cache)
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        ir.toGraph(output, format=format, dominators=dominators)
+    except Exception as error:
+        message = f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+        return BatchResult(filename, output, time.perf_counter() - start, message)
+    return BatchResult(filename, output, time.perf_counter() - start)
+
+# compile files over a process pool, results in input order
+# workers 1 compiles in this process
+def compileBatch(files: List[str], output_dir: str, workers: int = None, format: str = DOT, dominators: bool = False,
+                 cache_dir: str = None, cache_size: int = 64 << 20) -> List[BatchResult]:
+    outputs = outputPaths(files, output_dir, format)
+    arguments = [(filename, output, format, dominators, cache_dir, cache_size) for filename, output in zip(files, outputs)]
+    if workers == 1:
+        return [compileOne(*argument) for argument in arguments]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(compileOne, *argument) for argument in arguments]
+        return [future.result() for future in futures]
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="compile many SMPL sources into graph descriptions")
+    argument_parser.add_argument("inputs", nargs="+", help="source files, directories or glob patterns")
+    argument_parser.add_argument("-o", "--output-dir", default="graphs")
+    argument_parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes, default one per cpu")
+    argument_parser.add_argument("--pattern", default="*", help="file pattern inside input directories")
+    argument_parser.add_argument("--graph-format", choices=formats, default=DOT)
+    argument_parser.add_argument("--dominators", action="store_true", help="add dominator tree edges to the graphs")
+    argument_parser.add_argument("--cache", default=None, help="directory of the compiled ir cache")
+    argument_parser.add_argument("--cache-size", type=int, default=64 << 20, help="cache size bound in bytes")
+    argument_parser.add_argument("--report", default=None, help="write per file results as json")
+    args = argument_parser.parse_args()
+
+    files = expandInputs(args.inputs, args.pattern)
+    start = time.perf_counter()
+    results = compileBatch(files, args.output_dir, workers=args.workers, format=args.graph_format,
+                           dominators=args.dominators, cache_dir=args.cache, cache_size=args.cache_size)
+    elapsed = time.perf_counter() - start
+    failures = [result for result in results if result.error is not None]
+    for result in results:
+        status = "FAIL" if result.error is not None else "ok"
+        line = f"{status:4} {result.seconds * 1000:9.1f} ms  {result.filename}"
+        print(line + (f"  {result.error}" if result.error is not None else ""))
+    print(f"{len(results)} files, {len(failures)} failed, {elapsed:.2f} s")
+    if args.report:
+        with open(args.report, "w") as file:
+            json.dump({"seconds": elapsed, "results": [result.toDict() for result in results]}, file, indent=1)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from typing import *
+from smpl_parser import Parser
+
+# synthetic SMPL program of a tunable shape
+# statements: top level statements, every compound statement counts as one
+# variables: scalar variables, arrays: arrays with dimensions indices each
+# if_depth, loop_depth: nesting of if/else and while statements, 0 for none
+# body: statements in every nested block
+def generateProgram(statements: int = 100, variables: int = 8, arrays: int = 0, dimensions: int = 1,
+                    if_depth: int = 0, loop_depth: int = 0, body: int = 2, seed: int = 0) -> str:
+    generator = random.Random(seed)
+    names = [f"v{index}" for index in range(variables)]
+    array_names = [f"a{index}" for index in range(arrays)]
+
+    def operand() -> str:
+        choice = generator.random()
+        if array_names and choice < 0.3:
+            return arrayAccess()
+        if choice < 0.7:
+            return generator.choice(names)
+        return str(generator.randint(0, 9))
+
+    def arrayAccess() -> str:
+        # indices stay small and constant or scalar, they are not bounds checked
+        name = generator.choice(array_names)
+        return name + "".join(f"[{generator.choice([str(generator.randint(0, 3)), generator.choice(names)])}]" for _ in range(dimensions))
+
+    def expression() -> str:
+        return f"{operand()} {generator.choice('+-*')} {operand()}"
+
+    def relation() -> str:
+        return f"{operand()} {generator.choice(['<', '<=', '>', '>=', '==', '!='])} {operand()}"
+
+    def assignment() -> str:
+        if array_names and generator.random() < 0.3:
+            return f"let {arrayAccess()} <- {expression()}"
+        return f"let {generator.choice(names)} <- {expression()}"
+
+    def block(if_level: int, loop_level: int) -> str:
+        return ";\n".join(statement(if_level, loop_level) for _ in range(body))
+
+    def statement(if_level: int, loop_level: int) -> str:
+        choice = generator.random()
+        if if_level and choice < 0.5:
+            return f"if {relation()} then\n{block(if_level - 1, loop_level)}\nelse\n{block(if_level - 1, loop_level)}\nfi"
+        if loop_level and choice >= 0.5:
+            counter = generator.choice(names)
+            return f"while {counter} < 10 do\n{block(if_level, loop_level - 1)};\nlet {counter} <- {counter} + 1\nod"
+        return assignment()
+
+    lines = ["main", "var " + ", ".join(names) + ";"]
+    for name in array_names:
+        lines.append("array" + "[4]" * dimensions + f" {name};")
+    lines.append("{")
+    lines.append(";\n".join(statement(if_depth, loop_depth) for _ in range(statements)) + ";")
+    lines.append(f"call OutputNum({names[0]})")
+    lines.append("}.")
+    return "\n".join(lines) + "\n"
+
+# workload name: generateProgram arguments, sizes are multiplied by the scale
+workloads = {
+    "straight": {"statements": 20000, "variables": 8},
+    "variables": {"statements": 5000, "variables": 1000},
+    "ifs": {"statements": 200, "variables": 30, "if_depth": 6},
+    "loops": {"statements": 60, "variables": 12, "loop_depth": 4},
+    "arrays": {"statements": 5000, "variables": 8, "arrays": 8, "dimensions": 3},
+}
+scaled = ["statements", "variables"]
+
+def workloadSource(name: str, scale: float = 1.0, seed: int = 0) -> str:
+    arguments = dict(workloads[name])
+    for key in scaled:
+        arguments[key] = max(1, int(arguments[key] * scale))
+    return generateProgram(seed=seed, **arguments)
+
+# time the phases of compiling filename, best of repeat runs
+# scan covers the tokenizer and setting up the parser, parse covers parsing with ir construction
+def measure(filename: str, repeat: int = 3) -> dict:
+    best = {"scan": None, "parse": None, "graph": None}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parser = Parser(filename)
+        scanned = time.perf_counter()
+        parser.parse()
+        parsed = time.perf_counter()
+        parser.ir.toGraph(None)
+        done = time.perf_counter()
+        for phase, seconds in (("scan", scanned - start), ("parse", parsed - scanned), ("graph", done - parsed)):
+            if best[phase] is None or seconds < best[phase]:
+                best[phase] = seconds
+    tokens = len(parser.tokenizer.tokens)
+    instructions = parser.ir.pc
+    # a separate run, tracing allocations slows everything down
+    tracemalloc.start()
+    parser = Parser(filename)
+    parser.parse()
+    parser.ir.toGraph(None)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    total = best["scan"] + best["parse"] + best["graph"]
+    return dict(best, total=total, tokens=tokens, instructions=instructions, blocks=len(parser.ir.bb_list),
+                tokens_per_second=tokens / total, instructions_per_second=instructions / total, peak_bytes=peak)
+
+def runBenchmarks(names: List[str], scale: float = 1.0, repeat: int = 3, seed: int = 0) -> Dict[str, dict]:
+    results = {}
+    directory = tempfile.mkdtemp(prefix="smpl_bench")
+    try:
+        for name in names:
+            filename = os.path.join(directory, name + ".smpl")
+            with open(filename, "w") as file:
+                file.write(workloadSource(name, scale, seed))
+            results[name] = measure(filename, repeat)
+            os.remove(filename)
+    finally:
+        os.rmdir(directory)
+    return results
+
+# measurements worse than the baseline by more than tolerance, as readable lines
+compared = ["scan", "parse", "graph", "total", "peak_bytes"]
+
+def regressions(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float = 0.25) -> List[str]:
+    found = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for key in compared:
+            if key in reference and reference[key] > 0 and result[key] > reference[key] * (1 + tolerance):
+                found.append(f"{name} {key}: {result[key]:.4g} vs baseline {reference[key]:.4g} ({result[key] / reference[key]:.2f}x)")
+    return found
+
+def report(results: Dict[str, dict]) -> str:
+    lines = [f"{'workload':10} {'tokens':>8} {'instr':>8} {'scan ms':>9} {'parse ms':>9} {'graph ms':>9} {'tok/s':>10} {'instr/s':>10} {'peak MB':>8}"]
+    for name, result in results.items():
+        lines.append(f"{name:10} {result['tokens']:8} {result['instructions']:8} {result['scan'] * 1000:9.1f} {result['parse'] * 1000:9.1f} "
+                     f"{result['graph'] * 1000:9.1f} {result['tokens_per_second']:10.0f} {result['instructions_per_second']:10.0f} {result['peak_bytes'] / 1e6:8.1f}")
+    return "\n".join(lines)
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="benchmark the compiler on synthetic SMPL programs")
+    argument_parser.add_argument("workloads", nargs="*", help=f"some of {', '.join(workloads)}, default all")
+    argument_parser.add_argument("--scale", type=float, default=1.0, help="multiply workload sizes")
+    argument_parser.add_argument("--repeat", type=int, default=3, help="runs per workload, the best counts")
+    argument_parser.add_argument("--seed", type=int, default=0)
+    argument_parser.add_argument("--output", default=None, help="write results as json")
+    argument_parser.add_argument("--baseline", default=None, help="json results to compare with")
+    argument_parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline")
+    argument_parser.add_argument("--emit", default=None, help="write the source of the first workload and stop")
+    args = argument_parser.parse_args()
+    names = args.workloads or list(workloads)
+    for name in names:
+        if name not in workloads:
+            argument_parser.error(f"unknown workload {name}")
+
+    if args.emit:
+        with open(args.emit, "w") as file:
+            file.write(workloadSource(names[0], args.scale, args.seed))
+        return
+    results = runBenchmarks(names, args.scale, args.repeat, args.seed)
+    print(report(results))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"scale": args.scale, "seed": args.seed, "results": results}, file, indent=1)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get("scale") != args.scale or baseline.get("seed") != args.seed:
+            print("baseline was measured with a different scale or seed")
+        found = regressions(results, baseline["results"], args.tolerance)
+        for line in found:
+            print("regression", line)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
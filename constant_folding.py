@@ -0,0 +1,187 @@
+from typing import *
+import smpl_parser
+from def_use import valueOperants
+
+# lattice of a value: missing from the table while unknown, an int once constant
+varying = object()
+
+# constant folding and propagation over the ssa ir, sparse conditional constant propagation
+# values and the edges that can execute are found together, so a branch on a known
+# compare never makes the code it skips look reachable
+# foldable instructions become consts of the pool in bb0, branches on a known compare
+# keep one edge, blocks that cannot execute go and phis whose operants agree take their value
+# return counts of folded instructions, resolved branches and removed blocks
+def foldConstants(ir) -> Dict[str, int]:
+    predecessors = ir.predecessors()
+    values, executable = propagate(ir, predecessors)
+    replace = {}
+    branches = 0
+    for bb in ir.bb_list:
+        if id(bb) not in executable:
+            continue
+        for instruction in bb.instruction_list:
+            if instruction.op_code in smpl_parser.arithmetic_operators or instruction.op_code == "phi":
+                value = values.get(instruction.instruction_id)
+                if value is not None and value is not varying:
+                    replace[instruction.instruction_id] = ir.immediate(value)
+        if bb.instruction_list and resolveBranch(bb, values):
+            branches += 1
+    blocks = ir.removeUnreachable(predecessors)
+    if blocks:
+        ir.computeDominators()
+    folded = 0
+    while replace:
+        folded += applyReplacements(ir, replace)
+        replace = agreeingPhis(ir)
+    stats = {"folded": folded, "branches": branches, "blocks": blocks}
+    ir.diagnostics.phase("fold", f"{folded} folded, {branches} branches resolved, {blocks} blocks removed")
+    return stats
+
+# instruction id: constant value or varying, and the ids of the blocks that can execute
+def propagate(ir, predecessors: Dict[int, List["smpl_parser.Basic_Block"]]) -> Tuple[Dict[int, Any], Set[int]]:
+    # instruction id: (block, instruction) using its value
+    users = {}
+    for bb in ir.bb_list:
+        for instruction in bb.instruction_list:
+            for operant in valueOperants(instruction):
+                users.setdefault(operant, []).append((bb, instruction))
+    values = {}
+    executable = set()
+    edges = set()
+    flow = [(None, ir.bb_list[0])]
+    work = []
+
+    def lattice(operant):
+        if type(operant) != int:
+            return varying
+        return values.get(operant)
+
+    def follow(source, target):
+        if target is not None and (id(source), id(target)) not in edges:
+            flow.append((source, target))
+
+    def visit(bb, instruction):
+        op_code = instruction.op_code
+        if op_code == "phi":
+            value = None
+            for index, predecessor in enumerate(predecessors[id(bb)]):
+                if (id(predecessor), id(bb)) not in edges:
+                    continue
+                operant = lattice(instruction.operant1 if index == 0 else instruction.operant2)
+                if operant is None:
+                    continue
+                if value is None:
+                    value = operant
+                elif operant is varying or value != operant:
+                    value = varying
+        elif op_code == "const":
+            value = instruction.operant1 if type(instruction.operant1) == int else varying
+        elif op_code in smpl_parser.arithmetic_operators:
+            left, right = lattice(instruction.operant1), lattice(instruction.operant2)
+            if left is varying or right is varying:
+                value = varying
+            elif left is None or right is None:
+                value = None
+            else:
+                value = smpl_parser.evaluate(op_code, left, right)
+                if value is None:
+                    value = varying
+        elif op_code in smpl_parser.branch_conditions:
+            condition = lattice(instruction.operant1)
+            if condition is None:
+                return
+            if condition is varying or smpl_parser.branch_conditions[op_code](condition):
+                follow(bb, bb.branch)
+            if condition is varying or not smpl_parser.branch_conditions[op_code](condition):
+                follow(bb, bb.fall_through)
+            return
+        elif op_code == "bra":
+            follow(bb, bb.branch)
+            return
+        else:
+            value = varying
+        if value is None:
+            return
+        old = values.get(instruction.instruction_id)
+        if old is varying or (old is not None and old == value and value is not varying):
+            return
+        values[instruction.instruction_id] = value
+        work.extend(users.get(instruction.instruction_id, []))
+
+    while True:
+        drain(ir, flow, work, executable, edges, visit, follow)
+        # a value that never got defined, like a variable read before any assignment,
+        # must not hide the code behind a branch on it
+        stuck = [bb.instruction_list[-1].operant1 for bb in ir.bb_list if id(bb) in executable and bb.instruction_list
+                 and bb.instruction_list[-1].op_code in smpl_parser.branch_conditions and lattice(bb.instruction_list[-1].operant1) is None]
+        if not stuck:
+            break
+        for operant in stuck:
+            values[operant] = varying
+            work.extend(users.get(operant, []))
+    return values, executable
+
+def drain(ir, flow, work, executable, edges, visit, follow):
+    while flow or work:
+        while flow:
+            source, bb = flow.pop()
+            if source is not None:
+                edge = (id(source), id(bb))
+                if edge in edges:
+                    continue
+                edges.add(edge)
+            if id(bb) in executable:
+                # a new edge only changes the phis
+                for instruction in bb.instruction_list:
+                    if instruction.op_code == "phi":
+                        visit(bb, instruction)
+                continue
+            executable.add(id(bb))
+            for instruction in bb.instruction_list:
+                visit(bb, instruction)
+            if not bb.instruction_list or bb.instruction_list[-1].op_code not in smpl_parser.branch_conditions and bb.instruction_list[-1].op_code != "bra":
+                follow(bb, bb.fall_through)
+        while work:
+            bb, instruction = work.pop()
+            if id(bb) in executable:
+                visit(bb, instruction)
+
+# a branch on a const becomes a bra or goes, the edge not taken is removed
+def resolveBranch(bb, values: Dict[int, Any]) -> bool:
+    branch = bb.instruction_list[-1]
+    condition = smpl_parser.branch_conditions.get(branch.op_code)
+    if condition is None:
+        return False
+    value = values.get(branch.operant1)
+    if value is None or value is varying:
+        return False
+    if condition(value):
+        branch.op_code = "bra"
+        branch.operant1 = branch.operant2
+        branch.operant2 = None
+        bb.fall_through = None
+    else:
+        bb.instruction_list.pop()
+        bb.branch = None
+    return True
+
+# drop replaced instructions, rewrite operants and merge instructions that became equal
+# return the number of instructions removed
+def applyReplacements(ir, replace: Dict[int, int]) -> int:
+    for bb in ir.bb_list:
+        bb.instruction_list = [instruction for instruction in bb.instruction_list if instruction.instruction_id not in replace]
+    ir.rewriteRegion(ir.bb_list, replace)
+    return len(replace)
+
+# phis left with a single value once others were replaced or a join lost a side
+def agreeingPhis(ir) -> Dict[int, int]:
+    replace = {}
+    for bb in ir.bb_list:
+        for instruction in bb.instruction_list:
+            if instruction.op_code != "phi":
+                continue
+            operants = {instruction.operant1, instruction.operant2}
+            operants.discard(instruction.instruction_id)
+            if len(operants) == 1 and None not in operants:
+                replace[instruction.instruction_id] = operants.pop()
+    return replace
@@ -0,0 +1,57 @@
+from typing import *
+import smpl_parser
+from def_use import DefUse, valueOperants
+
+# instructions kept whether or not their value is used
+# read consumes input, kill orders the memory accesses around it and a call may do either
+root_operators = {"write", "writeNL", "read", "store", "end", "kill", "bra", "bne", "beq", "ble", "blt", "bge", "bgt",
+                  "param", "call", "ret"}
+
+# dead code elimination, everything the roots do not reach through the def-use chains goes
+# cycles of phis feeding only each other go too, like a loop variable nobody reads after the loop
+# unused consts leave the pool, branches into a block that lost its first instruction move on
+# return the count of removed instructions
+def eliminateDeadCode(ir) -> Dict[str, int]:
+    chains = DefUse(ir)
+    live = set()
+    work = [instruction for bb in ir.bb_list for instruction in bb.instruction_list if instruction.op_code in root_operators]
+    while work:
+        instruction = work.pop()
+        if instruction.instruction_id in live:
+            continue
+        live.add(instruction.instruction_id)
+        for operant in valueOperants(instruction):
+            definition = chains.definition(operant)
+            if definition is not None and operant not in live:
+                work.append(definition)
+    removed = 0
+    for bb in ir.bb_list:
+        kept = []
+        for instruction in bb.instruction_list:
+            if instruction.instruction_id in live:
+                kept.append(instruction)
+                continue
+            removed += 1
+            ir.memory_access.pop(instruction.instruction_id, None)
+            if instruction.op_code == "const" and ir.constants.get(instruction.operant1) == instruction.instruction_id:
+                del ir.constants[instruction.operant1]
+                ir.constant_values.pop(instruction.instruction_id, None)
+        bb.instruction_list = kept
+    if removed:
+        retargetBranches(ir, live)
+    ir.diagnostics.phase("dce", f"{removed} removed")
+    return {"removed": removed}
+
+# branch targets name the first instruction of the target block, removed ones are moved
+# to the first instruction left, following empty blocks
+def retargetBranches(ir, live: Set[int]):
+    for bb in ir.bb_list:
+        if not bb.instruction_list or bb.branch is None:
+            continue
+        branch = bb.instruction_list[-1]
+        if branch.op_code == "bra":
+            if branch.operant1 not in live:
+                branch.operant1 = ir.firstInstructionId(bb.branch, branch.operant1)
+        elif branch.op_code in smpl_parser.branch_operators:
+            if branch.operant2 not in live:
+                branch.operant2 = ir.firstInstructionId(bb.branch, branch.operant2)
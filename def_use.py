@@ -0,0 +1,58 @@
+from typing import *
+import smpl_parser
+
+# operants of instruction that name other instructions
+# const holds a number, kill an array, call a function and its argument count, arg a parameter index
+# and branch targets are positions, none of them is a value
+def valueOperants(instruction) -> List[int]:
+    op_code = instruction.op_code
+    if op_code == "const" or op_code == "kill" or op_code == "bra" or op_code == "call" or op_code == "arg":
+        return []
+    if op_code in smpl_parser.branch_operators:
+        operants = [instruction.operant1]
+    else:
+        operants = [instruction.operant1, instruction.operant2]
+    return [operant for operant in operants if type(operant) == int]
+
+# def-use chains of an ir, built in one pass over the blocks
+# definitions: instruction id: (block, instruction)
+# users: instruction id: instructions reading it, once per operant naming it
+class DefUse:
+    def __init__(self, ir):
+        self.definitions: Dict[int, Tuple["smpl_parser.Basic_Block", "smpl_parser.Instruction"]] = {}
+        self.users: Dict[int, List["smpl_parser.Instruction"]] = {}
+        for bb in ir.bb_list:
+            for instruction in bb.instruction_list:
+                self.definitions[instruction.instruction_id] = (bb, instruction)
+                for operant in valueOperants(instruction):
+                    self.users.setdefault(operant, []).append(instruction)
+
+    def definition(self, instruction_id: int) -> Optional["smpl_parser.Instruction"]:
+        entry = self.definitions.get(instruction_id)
+        return entry[1] if entry is not None else None
+
+    def isUsed(self, instruction_id: int) -> bool:
+        return bool(self.users.get(instruction_id))
+
+    # make every reader of old read new instead
+    # only the chain of old is walked, the cost is its number of uses and not the size of the ir
+    # the definition of old stays where it is, removing it is up to the caller
+    def replaceAllUses(self, old: int, new: int):
+        if old == new:
+            return
+        users = self.users.pop(old, [])
+        for instruction in users:
+            if instruction.operant1 == old:
+                instruction.operant1 = new
+            # the second operant of a branch is its target
+            if instruction.operant2 == old and instruction.op_code not in smpl_parser.branch_operators:
+                instruction.operant2 = new
+        self.users.setdefault(new, []).extend(users)
+
+    # forget instruction, its operants lose one reader
+    def remove(self, instruction):
+        self.definitions.pop(instruction.instruction_id, None)
+        for operant in valueOperants(instruction):
+            readers = self.users.get(operant)
+            if readers is not None and instruction in readers:
+                readers.remove(instruction)
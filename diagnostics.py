@@ -0,0 +1,70 @@
+import io
+
+# diagnostic levels, a sink records every message at or below its level
+OFF = 0
+# compilation phases
+PHASE = 1
+# ssa tables of every basic block
+SSA = 2
+# token trace of the tokenizer
+TOKEN = 3
+
+level_names = {"off": OFF, "phase": PHASE, "ssa": SSA, "token": TOKEN}
+
+# levelled diagnostics sink, off by default
+# messages are buffered and written to target in large batches
+# target: None collects in memory, a str opens that path, anything else is a writable file object
+class Diagnostics:
+    def __init__(self, level: int = OFF, target = None, buffer_size: int = 1 << 16):
+        self.level = level
+        self.buffer_size = buffer_size
+        self.pending = []
+        self.pending_size = 0
+        self.line_start = True
+        self.owns_target = False
+        if target is None:
+            target = io.StringIO()
+        elif isinstance(target, str):
+            target = open(target, "w")
+            self.owns_target = True
+        self.target = target
+
+    def enabled(self, level: int) -> bool:
+        return level <= self.level
+
+    def write(self, level: int, text: str):
+        if level > self.level:
+            return
+        self.pending.append(text)
+        self.pending_size += len(text)
+        self.line_start = text.endswith("\n")
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    def token(self, token: int):
+        self.write(TOKEN, f"{token} ")
+
+    def newline(self):
+        self.write(TOKEN, "\n")
+
+    def phase(self, name: str, detail: str = ""):
+        # phase events start on their own line
+        text = f"[{name}] {detail}\n" if detail else f"[{name}]\n"
+        self.write(PHASE, text if self.line_start else "\n" + text)
+
+    def flush(self):
+        if self.pending:
+            self.target.write("".join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+        self.target.flush()
+
+    def close(self):
+        self.flush()
+        if self.owns_target:
+            self.target.close()
+
+    # collected text of an in-memory sink
+    def getvalue(self) -> str:
+        self.flush()
+        return self.target.getvalue()
@@ -0,0 +1,184 @@
+import io
+import json
+import struct
+from typing import *
+
+# output formats
+DOT = "dot"
+JSONL = "jsonl"
+BINARY = "binary"
+formats = [DOT, JSONL, BINARY]
+
+# edge kinds of the jsonl and binary formats
+BRANCH = 0
+FALL_THROUGH = 1
+DOMINATOR = 2
+edge_names = ["branch", "fall-through", "dom"]
+
+# binary format, little endian
+#   header: magic, u8 version, u8 flags (bit 0: dominator edges)
+#           u8 op code count, op codes as u8 length + ascii
+#           u32 symbol count, symbols as u16 length + utf-8
+#           u32 block count
+#   block:  u32 bb id, u32 instruction count, instructions, u8 edge count, edges
+#   instruction: i32 id, u8 op code index, operant1, operant2
+#   operant: u8 tag, 0 none, 1 followed by i64, 2 followed by u16 length + utf-8
+#   edge:   u32 target bb id, u8 kind
+#   functions: u32 function count, functions
+#   function: u32 name symbol id, u8 void, u8 parameter count, u32 parameter symbol ids,
+#             u32 block count, blocks
+# a dominator edge is stored with its child, from the immediate dominator
+magic = b"SCFG"
+version = 2
+op_codes = ["const", "add", "sub", "mul", "div", "cmp", "adda", "load", "store", "phi", "kill", "end",
+            "bra", "bne", "beq", "ble", "blt", "bge", "bgt", "read", "write", "writeNL",
+            "param", "call", "arg", "ret"]
+op_index = {op_code: index for index, op_code in enumerate(op_codes)}
+
+# writes the control flow graph of an ir in one pass over the blocks
+# output is collected in pending and written to target in large batches
+# target: None collects in memory, a str opens that path, anything else is a writable file object
+# binary needs a target opened in binary mode, dot and jsonl a text one
+class GraphEmitter:
+    def __init__(self, target = None, format: str = DOT, dominators: bool = False, buffer_size: int = 1 << 16):
+        if format not in formats:
+            raise Exception(f"unknown graph format {format}")
+        self.format = format
+        self.dominators = dominators
+        self.buffer_size = buffer_size
+        self.pending = []
+        self.pending_size = 0
+        self.owns_target = False
+        binary = format == BINARY
+        if target is None:
+            target = io.BytesIO() if binary else io.StringIO()
+        elif isinstance(target, str):
+            target = open(target, "wb" if binary else "w")
+            self.owns_target = True
+        self.target = target
+
+    def write(self, data):
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    def emit(self, ir):
+        if self.format == DOT:
+            self.emitDot(ir)
+        elif self.format == JSONL:
+            self.emitJsonLines(ir)
+        else:
+            self.emitBinary(ir)
+        self.flush()
+
+    # every function is a cluster after main, its nodes named after the function
+    def emitDot(self, ir):
+        self.write('digraph G{\n')
+        self.dotBlocks(ir, "")
+        for function in ir.functions.values():
+            name = ir.symbols.name(function.name)
+            self.write(f'subgraph cluster_{name} {{\nlabel="{name}({", ".join(ir.symbols.name(param) for param in function.params)})";\n')
+            self.dotBlocks(function, f"{name}_")
+            self.write('}\n')
+        self.write('}')
+
+    def dotBlocks(self, ir, prefix: str):
+        for bb in ir.bb_list:
+            self.write(bb.instructionToGraph(ir.symbols, prefix) + '\n')
+        for bb in ir.bb_list:
+            if bb.branch:
+                self.write(bb.branchToGraph(prefix) + '\n')
+            if bb.fall_through:
+                self.write(bb.fallThroughToGraph(prefix) + '\n')
+            if self.dominators and bb.idom:
+                self.write(bb.dominatorToGraph(prefix) + '\n')
+
+    # header line with the names kill and call operants refer to, then one line per block of main
+    # every function follows as a line naming it and one line per block
+    def emitJsonLines(self, ir):
+        self.write(json.dumps({"format": "smpl-cfg", "version": version, "symbols": ir.symbols.names}) + "\n")
+        self.jsonBlocks(ir)
+        for function in ir.functions.values():
+            self.write(json.dumps({"function": function.name, "void": function.void, "params": function.params}) + "\n")
+            self.jsonBlocks(function)
+
+    def jsonBlocks(self, ir):
+        for bb in ir.bb_list:
+            record = {
+                "bb": bb.bb_id,
+                "instructions": [[instruction.instruction_id, instruction.op_code, instruction.operant1, instruction.operant2] for instruction in bb.instruction_list],
+                "edges": [[target, edge_names[kind]] for target, kind in self.edges(bb)],
+            }
+            self.write(json.dumps(record) + "\n")
+
+    def emitBinary(self, ir):
+        header = [magic, struct.pack("<BBB", version, 1 if self.dominators else 0, len(op_codes))]
+        for op_code in op_codes:
+            header.append(struct.pack("<B", len(op_code)) + op_code.encode("ascii"))
+        header.append(struct.pack("<I", len(ir.symbols.names)))
+        for name in ir.symbols.names:
+            data = name.encode("utf-8")
+            header.append(struct.pack("<H", len(data)) + data)
+        self.write(b"".join(header))
+        self.binaryBlocks(ir)
+        self.write(struct.pack("<I", len(ir.functions)))
+        for function in ir.functions.values():
+            self.write(struct.pack(f"<IBB{len(function.params)}I", function.name, 1 if function.void else 0,
+                                   len(function.params), *function.params))
+            self.binaryBlocks(function)
+
+    def binaryBlocks(self, ir):
+        self.write(struct.pack("<I", len(ir.bb_list)))
+        pack_instruction = struct.Struct("<iB").pack
+        pack_edge = struct.Struct("<IB").pack
+        for bb in ir.bb_list:
+            parts = [struct.pack("<II", bb.bb_id, len(bb.instruction_list))]
+            for instruction in bb.instruction_list:
+                index = op_index.get(instruction.op_code)
+                if index is None:
+                    raise Exception(f"no binary encoding for {instruction.op_code}")
+                parts.append(pack_instruction(instruction.instruction_id, index))
+                parts.append(packOperant(instruction.operant1))
+                parts.append(packOperant(instruction.operant2))
+            edges = self.edges(bb)
+            parts.append(struct.pack("<B", len(edges)))
+            for target, kind in edges:
+                parts.append(pack_edge(target, kind))
+            self.write(b"".join(parts))
+
+    # (target bb id, kind) of the edges listed with bb
+    def edges(self, bb) -> List[Tuple[int, int]]:
+        edges = []
+        if bb.branch:
+            edges.append((bb.branch.bb_id, BRANCH))
+        if bb.fall_through:
+            edges.append((bb.fall_through.bb_id, FALL_THROUGH))
+        if self.dominators and bb.idom:
+            edges.append((bb.idom.bb_id, DOMINATOR))
+        return edges
+
+    def flush(self):
+        if self.pending:
+            self.target.write(("" if self.format != BINARY else b"").join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+        self.target.flush()
+
+    def close(self):
+        self.flush()
+        if self.owns_target:
+            self.target.close()
+
+    # collected output of an in-memory target
+    def getvalue(self):
+        self.flush()
+        return self.target.getvalue()
+
+def packOperant(operant) -> bytes:
+    if operant is None:
+        return b"\x00"
+    if isinstance(operant, int):
+        return b"\x01" + struct.pack("<q", operant)
+    data = str(operant).encode("utf-8")
+    return b"\x02" + struct.pack("<H", len(data)) + data
@@ -0,0 +1,139 @@
+from typing import *
+import smpl_parser
+
+# most instructions of a function inlined at its calls, consts not counted
+max_inline_size = 40
+
+# inline calls of small functions that are not recursive
+# a function can only call the ones declared before it and itself, the functions are done in
+# declaration order and main last, so the bodies copied in are already inlined themselves
+# only functions returning from the end of their last block are inlined
+# functions no call reaches any more go
+# return counts of inlined calls and removed functions
+def inlineFunctions(ir) -> Dict[str, int]:
+    inlined = 0
+    for caller in ir.withFunctions()[1:] + [ir]:
+        replace = {}
+        for bb in list(caller.bb_list):
+            position = 0
+            while position < len(bb.instruction_list):
+                instruction = bb.instruction_list[position]
+                callee = ir.functions.get(instruction.operant1) if instruction.op_code == "call" else None
+                if callee is None or callee is caller or not inlinable(callee):
+                    position += 1
+                    continue
+                # the rest of bb moved to a new block, the search goes on there
+                bb = inlineCall(caller, bb, position, callee, replace)
+                position = 0
+                inlined += 1
+        if replace:
+            caller.computeDominators()
+            caller.rewriteRegion(caller.bb_list, replace)
+    removed = removeUncalled(ir)
+    ir.diagnostics.phase("inline", f"{inlined} calls inlined, {removed} functions removed")
+    return {"inlined": inlined, "removed": removed}
+
+def inlinable(function) -> bool:
+    last = function.bb_list[-1]
+    if last.branch is not None or last.fall_through is not None:
+        return False
+    if not last.instruction_list or last.instruction_list[-1].op_code != "ret":
+        return False
+    size = 0
+    for bb in function.bb_list[1:]:
+        for instruction in bb.instruction_list:
+            if instruction.op_code == "ret" and instruction is not last.instruction_list[-1]:
+                return False
+            if instruction.op_code == "call" and instruction.operant1 == function.name:
+                return False
+            size += 1
+    return size <= max_inline_size
+
+# replace the call at position of bb by a copy of the blocks of callee
+# bb keeps what comes before the params of the call and falls through into the copy,
+# the copy of the last block falls through into a new block with the rest of bb
+# replace gets the value of the call and the dropped params and ret
+# return the new block
+def inlineCall(caller, bb, position: int, callee, replace: Dict[int, int]):
+    call = bb.instruction_list[position]
+    start = position - call.operant2
+    params = bb.instruction_list[start:position]
+    if any(param.op_code != "param" for param in params):
+        raise Exception(f"params of call {call.instruction_id} are not in front of it")
+    arguments = [param.operant1 for param in params]
+    # callee instruction id: caller value
+    values = {}
+    for instruction in callee.bb_list[0].instruction_list:
+        values[instruction.instruction_id] = caller.immediate(instruction.operant1)
+    blocks = {}
+    copies = []
+    for source in callee.bb_list[1:]:
+        copy = smpl_parser.Basic_Block(0)
+        copy.ssa_table = smpl_parser.SSATable(bb.ssa_table)
+        blocks[id(source)] = copy
+        copies.append(copy)
+        for instruction in source.instruction_list:
+            if instruction.op_code == "arg":
+                values[instruction.instruction_id] = arguments[instruction.operant1]
+                continue
+            clone = smpl_parser.Instruction(caller.pc, instruction.op_code, instruction.operant1, instruction.operant2)
+            caller.pc += 1
+            values[instruction.instruction_id] = clone.instruction_id
+            if instruction.instruction_id in callee.memory_access:
+                caller.memory_access[clone.instruction_id] = callee.memory_access[instruction.instruction_id]
+            copy.instruction_list.append(clone)
+    for source in callee.bb_list[1:]:
+        copy = blocks[id(source)]
+        copy.branch = blocks.get(id(source.branch))
+        copy.fall_through = blocks.get(id(source.fall_through))
+        if source.parents is not None:
+            copy.parents = [blocks[id(parent)] for parent in source.parents if id(parent) in blocks]
+        for clone in copy.instruction_list:
+            if clone.op_code in ("const", "kill", "call"):
+                continue
+            if clone.op_code == "bra":
+                clone.operant1 = caller.firstInstructionId(copy.branch, clone.operant1)
+                continue
+            clone.operant1 = values.get(clone.operant1, clone.operant1)
+            if clone.op_code in smpl_parser.branch_operators:
+                clone.operant2 = caller.firstInstructionId(copy.branch, clone.operant2)
+            else:
+                clone.operant2 = values.get(clone.operant2, clone.operant2)
+    ret = copies[-1].instruction_list.pop()
+    value = ret.operant1 if ret.operant1 is not None else caller.immediate(0)
+    replace[call.instruction_id] = value
+    replace[ret.instruction_id] = value
+    for param in params:
+        replace[param.instruction_id] = param.operant1
+    rest = smpl_parser.Basic_Block(0)
+    rest.ssa_table = smpl_parser.SSATable(bb.ssa_table)
+    rest.instruction_list = bb.instruction_list[position + 1:]
+    rest.branch, rest.fall_through = bb.branch, bb.fall_through
+    bb.instruction_list = bb.instruction_list[:start]
+    bb.branch = None
+    bb.fall_through = copies[0]
+    copies[-1].fall_through = rest
+    for other in caller.bb_list:
+        if other.parents is not None:
+            other.parents = [rest if parent is bb else parent for parent in other.parents]
+    index = caller.bb_list.index(bb) + 1
+    caller.bb_list[index:index] = copies + [rest]
+    for bb_id, block in enumerate(caller.bb_list):
+        block.bb_id = bb_id
+    caller.bb_count = len(caller.bb_list) - 1
+    return rest
+
+# drop the functions neither main nor a function called from it calls
+# return how many went
+def removeUncalled(ir) -> int:
+    called = set()
+    work = [ir]
+    while work:
+        for bb in work.pop().bb_list:
+            for instruction in bb.instruction_list:
+                if instruction.op_code == "call" and instruction.operant1 not in called:
+                    called.add(instruction.operant1)
+                    work.append(ir.functions[instruction.operant1])
+    removed = len(ir.functions) - len(called)
+    ir.functions = {name: function for name, function in ir.functions.items() if name in called}
+    return removed
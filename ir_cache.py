@@ -0,0 +1,247 @@
+import os
+import struct
+import hashlib
+from typing import *
+import smpl_parser
+from graph_emitter import op_codes, op_index, packOperant
+from symbol_table import SymbolTable
+
+# bump when the serialized layout changes
+cache_format = 3
+# sources of everything that shapes the ir, any edit invalidates the cache
+compiler_modules = ["smpl_parser.py", "tokenizer.py", "symbol_table.py", "graph_emitter.py", "ir_cache.py"]
+compiler_digest = None
+
+def compilerVersion() -> str:
+    global compiler_digest
+    if compiler_digest is None:
+        digest = hashlib.sha256(f"format {cache_format}\n".encode())
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in compiler_modules:
+            with open(os.path.join(directory, name), "rb") as file:
+                digest.update(file.read())
+        compiler_digest = digest.hexdigest()
+    return compiler_digest
+
+# serialized ir, little endian
+#   header: magic, u8 format, u32 symbol count, symbols as u16 length + utf-8
+#           u32 array count, arrays as u16 length + utf-8 base const name, u8 dimension count, i64 dimensions
+#   body:   u32 pc, u32 block count, blocks, trailer
+#           u32 function count, functions as u32 name symbol id, u8 void, u8 parameter count,
+#           u32 parameter symbol ids, body
+#   block:  i32 branch, i32 fall through, i32 immediate dominator, i32 block owning the parent ssa table
+#           u8 parent count, u32 parent ids
+#           u32 instruction count, instructions as i32 id, u8 op code index, operant1, operant2
+#           u32 definition count, definitions as u32 ident, value
+#   value:  u8 tag, 1 followed by i64, 3 array entry: i64 base, u8 dimension count, i64 dimensions, u8 stored
+#   trailer: u32 count, memory accesses as i32 load or adda id, u32 array id
+#   operants are encoded as in the binary graph format, -1 means no block
+#   a table whose parent belongs to no block any more is stored flattened
+magic = b"SIRC"
+stored_codes = {False: 0, True: 1, None: 2}
+stored_values = [False, True, None]
+
+def dumpIR(ir) -> bytes:
+    parts = [magic, struct.pack("<BI", cache_format, len(ir.symbols.names))]
+    for name in ir.symbols.names:
+        data = name.encode("utf-8")
+        parts.append(struct.pack("<H", len(data)) + data)
+    parts.append(struct.pack("<I", len(ir.arrays)))
+    for name, dimension in ir.arrays.items():
+        data = name.encode("utf-8")
+        parts.append(struct.pack(f"<H{len(data)}sB{len(dimension)}q", len(data), data, len(dimension), *dimension))
+    dumpBody(ir, parts)
+    return b"".join(parts)
+
+def dumpBody(ir, parts: List[bytes]):
+    owners = {id(bb.ssa_table): bb.bb_id for bb in ir.bb_list}
+    parts.append(struct.pack("<II", ir.pc, len(ir.bb_list)))
+    pack_instruction = struct.Struct("<iB").pack
+    for bb in ir.bb_list:
+        parent = bb.ssa_table.parent
+        definitions = bb.ssa_table.definitions
+        if parent is not None and id(parent) not in owners:
+            parent = None
+            definitions = dict(bb.ssa_table.items())
+        parts.append(struct.pack("<iiii",
+            bb.branch.bb_id if bb.branch else -1,
+            bb.fall_through.bb_id if bb.fall_through else -1,
+            bb.idom.bb_id if bb.idom else -1,
+            owners[id(parent)] if parent is not None else -1))
+        parents = bb.parents or []
+        parts.append(struct.pack(f"<B{len(parents)}I", len(parents), *[parent.bb_id for parent in parents]))
+        parts.append(struct.pack("<I", len(bb.instruction_list)))
+        for instruction in bb.instruction_list:
+            parts.append(pack_instruction(instruction.instruction_id, op_index[instruction.op_code]))
+            parts.append(packOperant(instruction.operant1))
+            parts.append(packOperant(instruction.operant2))
+        parts.append(struct.pack("<I", len(definitions)))
+        for ident, value in definitions.items():
+            if type(value) == int:
+                parts.append(struct.pack("<IBq", ident, 1, value))
+            else:
+                parts.append(struct.pack(f"<IBqB{len(value.dimension)}qB", ident, 3, value.base_addr,
+                    len(value.dimension), *value.dimension, stored_codes[value.stored]))
+    parts.append(struct.pack("<I", len(ir.memory_access)))
+    for instruction_id, array_id in ir.memory_access.items():
+        parts.append(struct.pack("<iI", instruction_id, array_id))
+    parts.append(struct.pack("<I", len(ir.functions)))
+    for function in ir.functions.values():
+        parts.append(struct.pack(f"<IBB{len(function.params)}I", function.name, 1 if function.void else 0,
+                                 len(function.params), *function.params))
+        dumpBody(function, parts)
+
+# sequential reader over a serialized ir
+class Reader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.position = 0
+
+    def unpack(self, format: str) -> tuple:
+        values = struct.unpack_from(format, self.data, self.position)
+        self.position += struct.calcsize(format)
+        return values
+
+    def one(self, format: str):
+        return self.unpack(format)[0]
+
+    def text(self) -> str:
+        length = self.one("<H")
+        self.position += length
+        return self.data[self.position - length:self.position].decode("utf-8")
+
+    def operant(self):
+        tag = self.one("<B")
+        if tag == 0:
+            return None
+        if tag == 1:
+            return self.one("<q")
+        return self.text()
+
+def loadIR(data: bytes, diagnostics = None):
+    if data[:len(magic)] != magic:
+        raise Exception("not a serialized ir")
+    reader = Reader(data)
+    reader.position = len(magic)
+    format = reader.one("<B")
+    if format != cache_format:
+        raise Exception(f"serialized ir format {format}, expected {cache_format}")
+    symbols = SymbolTable()
+    for _ in range(reader.one("<I")):
+        symbols.intern(reader.text())
+    arrays = {}
+    for _ in range(reader.one("<I")):
+        name = reader.text()
+        arrays[name] = list(reader.unpack(f"<{reader.one('<B')}q"))
+    return loadBody(reader, diagnostics, symbols, arrays)
+
+def loadBody(reader: Reader, diagnostics, symbols: SymbolTable, arrays: Dict[str, List[int]]):
+    pc, bb_total = reader.unpack("<II")
+    ir = smpl_parser.IR(diagnostics=diagnostics, symbols=symbols)
+    ir.arrays = arrays
+    ir.bb_list = [smpl_parser.Basic_Block(bb_id) for bb_id in range(bb_total)]
+    for bb in ir.bb_list:
+        branch, fall_through, idom, table_owner = reader.unpack("<iiii")
+        bb.branch = ir.bb_list[branch] if branch >= 0 else None
+        bb.fall_through = ir.bb_list[fall_through] if fall_through >= 0 else None
+        if idom >= 0:
+            bb.idom = ir.bb_list[idom]
+            bb.idom.dom_children.append(bb)
+        # parent tables belong to blocks created earlier
+        bb.ssa_table = smpl_parser.SSATable(ir.bb_list[table_owner].ssa_table if table_owner >= 0 else None)
+        parent_count = reader.one("<B")
+        if parent_count:
+            bb.parents = [ir.bb_list[parent] for parent in reader.unpack(f"<{parent_count}I")]
+        for _ in range(reader.one("<I")):
+            instruction_id, op = reader.unpack("<iB")
+            bb.instruction_list.append(smpl_parser.Instruction(instruction_id, op_codes[op], reader.operant(), reader.operant()))
+        definitions = {}
+        for _ in range(reader.one("<I")):
+            ident, tag = reader.unpack("<IB")
+            if tag == 1:
+                definitions[ident] = reader.one("<q")
+            else:
+                base_addr, count = reader.unpack("<qB")
+                dimension = list(reader.unpack(f"<{count}q"))
+                definitions[ident] = smpl_parser.ArrayEntry(base_addr, dimension, stored_values[reader.one("<B")])
+        bb.ssa_table.definitions = definitions
+    for _ in range(reader.one("<I")):
+        instruction_id, array_id = reader.unpack("<iI")
+        ir.memory_access[instruction_id] = array_id
+    ir.bb_count = bb_total - 1
+    ir.pc = pc
+    ir.constants = {instruction.operant1: instruction.instruction_id for instruction in ir.bb_list[0].instruction_list if instruction.op_code == "const"}
+    ir.constant_values = {instruction_id: value for value, instruction_id in ir.constants.items()}
+    ir.numberDominatorTree()
+    for _ in range(reader.one("<I")):
+        name, void, count = reader.unpack("<IBB")
+        params = list(reader.unpack(f"<{count}I"))
+        function = loadBody(reader, diagnostics, symbols, arrays)
+        function.name = name
+        function.void = bool(void)
+        function.params = params
+        ir.functions[name] = function
+    return ir
+
+# content addressed ir cache in a directory, one file per entry
+# keyed by the source bytes and the compiler version
+# hits refresh the entry, the least recently used entries go once max_bytes is exceeded
+class IRCache:
+    def __init__(self, directory: str, max_bytes: int = 64 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source: bytes) -> str:
+        digest = hashlib.sha256(compilerVersion().encode())
+        digest.update(source)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".ir")
+
+    # cached ir of source, None on a miss
+    def get(self, source: bytes, diagnostics = None):
+        path = self.path(self.key(source))
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        # another process may have evicted it since, the data read is still good
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return loadIR(data, diagnostics)
+
+    def put(self, source: bytes, ir):
+        path = self.path(self.key(source))
+        # written under a private name first, readers never see a partial entry
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(dumpIR(ir))
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".ir"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
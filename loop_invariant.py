@@ -0,0 +1,91 @@
+from typing import *
+import smpl_parser
+from def_use import valueOperants
+from dead_code import retargetBranches
+
+# operators that cannot fault, they move out of a loop from anywhere in it
+pure_operators = {"add", "sub", "mul", "cmp", "adda"}
+
+# loop invariant code motion, instructions of a loop whose operants all come from outside it
+# move to the preheader, innermost loops first so their invariants can leave the outer ones too
+# a load moves when nothing in the loop kills or stores its array and nothing is called,
+# a load or a div by a value that may be 0 only from the header, which runs whenever the
+# preheader does, elsewhere the loop might never have executed it
+# instructions that became equal are merged afterwards
+# return counts of hoisted instructions and of loops they left
+def hoistInvariants(ir) -> Dict[str, int]:
+    ir.computeDominators()
+    loops = ir.naturalLoops()
+    # const id: its number
+    constants = {instruction.instruction_id: instruction.operant1 for instruction in ir.bb_list[0].instruction_list
+                 if instruction.op_code == "const" and type(instruction.operant1) == int}
+    hoisted = 0
+    changed_loops = 0
+    moved_ids = set()
+    for header, blocks in loops:
+        moved = invariants(ir, header, blocks, constants)
+        if not moved:
+            continue
+        preheader = ir.preheader(header, blocks)
+        if preheader is None:
+            continue
+        # a new block on the entry edge is part of every loop around this one
+        for other_header, other_blocks in loops:
+            if any(bb is header for bb in other_blocks) and not any(bb is preheader for bb in other_blocks):
+                other_blocks.append(preheader)
+        for bb, instruction in moved:
+            bb.instruction_list.remove(instruction)
+            preheader.instruction_list.append(instruction)
+            moved_ids.add(instruction.instruction_id)
+        hoisted += len(moved)
+        changed_loops += 1
+    if hoisted:
+        retargetBranches(ir, {instruction.instruction_id for bb in ir.bb_list for instruction in bb.instruction_list} - moved_ids)
+        ir.computeDominators()
+        ir.rewriteRegion(ir.bb_list, {})
+    ir.diagnostics.phase("licm", f"{hoisted} hoisted out of {changed_loops} loops")
+    return {"hoisted": hoisted, "loops": changed_loops}
+
+# (block, instruction) pairs of the loop that can move, in an order defining operants first
+def invariants(ir, header, blocks, constants: Dict[int, int]) -> List[tuple]:
+    defined = set()
+    stored = set()
+    # memory of every array may change
+    clobbered = False
+    for bb in blocks:
+        for instruction in bb.instruction_list:
+            defined.add(instruction.instruction_id)
+            if instruction.op_code == "kill":
+                stored.add(instruction.operant1)
+            elif instruction.op_code == "store":
+                # an address that is no adda may point into any array
+                array_id = ir.memory_access.get(instruction.operant1)
+                if array_id is None:
+                    clobbered = True
+                stored.add(array_id)
+            elif instruction.op_code == "call":
+                clobbered = True
+    moved = []
+    invariant = set()
+    changed = True
+    while changed:
+        changed = False
+        for bb in blocks:
+            for instruction in bb.instruction_list:
+                if instruction.instruction_id in invariant or not movable(ir, instruction, bb is header, stored, clobbered, constants):
+                    continue
+                if all(operant not in defined or operant in invariant for operant in valueOperants(instruction)):
+                    invariant.add(instruction.instruction_id)
+                    moved.append((bb, instruction))
+                    changed = True
+    return moved
+
+def movable(ir, instruction, in_header: bool, stored: Set[int], clobbered: bool, constants: Dict[int, int]) -> bool:
+    op_code = instruction.op_code
+    if op_code in pure_operators:
+        return True
+    if op_code == "div":
+        return in_header or constants.get(instruction.operant2, 0) != 0
+    if op_code == "load":
+        return in_header and not clobbered and ir.memory_access.get(instruction.instruction_id) not in stored
+    return False
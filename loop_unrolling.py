@@ -0,0 +1,308 @@
+from typing import *
+import smpl_parser
+from strength_reduction import inductionVariables
+
+# most instructions the copies of a loop may add up to
+max_unrolled_size = 64
+# copies of the body run by one iteration of a partially unrolled loop
+unroll_factor = 4
+# trip counts are found by running the header compare, longer loops count as unknown
+max_trip_count = 1 << 16
+
+# unroll while loops with a constant trip count, the header compares an induction variable
+# starting at a const with a const
+# a loop whose copies fit in max_unrolled_size is replaced by them, a larger one runs
+# unroll_factor copies of its body per iteration and the iterations left over run as
+# straight copies behind it
+# a copy after the first of a sequence starts with the header instructions, the last copy
+# of the header is left where the loop exits, so later uses of its values find them there
+# instructions that became equal are merged afterwards
+# return counts of fully and partially unrolled loops
+def unrollLoops(ir) -> Dict[str, int]:
+    full = 0
+    partial = 0
+    # headers looked at and their copies, kept by id
+    seen = {}
+    changed = True
+    while changed:
+        changed = False
+        ir.computeDominators()
+        for header, blocks in ir.naturalLoops():
+            if id(header) in seen:
+                continue
+            seen[id(header)] = header
+            shape = loopShape(ir, header, blocks)
+            if shape is None:
+                continue
+            count, compare, phi = shape
+            body = [bb for bb in blocks if bb is not header]
+            size = sum(len(bb.instruction_list) for bb in blocks)
+            if count * size <= max_unrolled_size:
+                preheader = ir.preheader(header, blocks)
+                if preheader is None:
+                    continue
+                unrollFully(ir, header, body, preheader, count, seen)
+                full += 1
+            elif count >= unroll_factor and unroll_factor * size <= max_unrolled_size:
+                bound = exitBound(ir, header, blocks, count, compare, phi)
+                if bound is None or ir.preheader(header, blocks) is None:
+                    continue
+                unrollPartially(ir, header, body, count, compare, phi, bound, seen)
+                partial += 1
+            else:
+                continue
+            changed = True
+            break
+    if full or partial:
+        ir.computeDominators()
+        ir.rewriteRegion(ir.bb_list, {})
+    ir.diagnostics.phase("unroll", f"{full} loops fully and {partial} partially unrolled")
+    return {"full": full, "partial": partial}
+
+# (trip count, header compare, induction phi) of a loop that can be unrolled, None otherwise
+# the header ends with a branch on the compare leaving the loop, the only way out,
+# the latch jumps back to it with a bra and the block left for has no other predecessor
+def loopShape(ir, header, blocks) -> Optional[tuple]:
+    inside = {id(bb) for bb in blocks}
+    if len(header.instruction_list) < 2 or header.branch is None or id(header.branch) in inside:
+        return None
+    if header.fall_through is None or id(header.fall_through) not in inside:
+        return None
+    predecessors = ir.predecessors()
+    entering = predecessors[id(header)]
+    if len(entering) != 2 or id(entering[0]) in inside or id(entering[1]) not in inside:
+        return None
+    latch = entering[1]
+    if latch is not blocks[-1] or not smpl_parser.endsWithBra(latch):
+        return None
+    for bb in blocks:
+        if bb is header:
+            continue
+        for child in ir.successors(bb):
+            if id(child) not in inside or (child is header and bb is not latch):
+                return None
+    if len(predecessors[id(header.branch)]) != 1 or any(instruction.op_code == "phi" for instruction in header.branch.instruction_list):
+        return None
+    branch = header.instruction_list[-1]
+    if branch.op_code not in smpl_parser.branch_conditions:
+        return None
+    compare = next((instruction for instruction in header.instruction_list if instruction.instruction_id == branch.operant1), None)
+    if compare is None or compare.op_code != "cmp":
+        return None
+    induction = inductionVariables(ir, header, blocks)
+    if compare.operant1 in induction and type(ir.constant_values.get(compare.operant2)) == int:
+        phi_id, bound = compare.operant1, ir.constant_values[compare.operant2]
+    elif compare.operant2 in induction and type(ir.constant_values.get(compare.operant1)) == int:
+        phi_id, bound = compare.operant2, ir.constant_values[compare.operant1]
+    else:
+        return None
+    phi = next(instruction for instruction in header.instruction_list if instruction.instruction_id == phi_id)
+    value = ir.constant_values.get(phi.operant1)
+    if type(value) != int:
+        return None
+    count = 0
+    while not exits(branch.op_code, compare, phi_id, value, bound):
+        count += 1
+        if count > max_trip_count:
+            return None
+        value += induction[phi_id]
+    return count, compare, phi
+
+# whether the header branch leaves the loop with the induction variable at value
+def exits(op_code: str, compare, phi_id: int, value: int, bound: int) -> bool:
+    left, right = (value, bound) if compare.operant1 == phi_id else (bound, value)
+    return smpl_parser.branch_conditions[op_code](smpl_parser.evaluate("cmp", left, right))
+
+# the preheader falls through count copies of the loop into a last copy of the header,
+# which falls through where the loop exited
+def unrollFully(ir, header, body: List, preheader, count: int, seen: Dict[int, Any]):
+    phis = [instruction for instruction in header.instruction_list if instruction.op_code == "phi"]
+    values = {phi.instruction_id: phi.operant1 for phi in phis}
+    copies = copyIterations(ir, header, body, phis, values, count, True, seen)
+    last = copyHeader(ir, header, values)
+    if copies:
+        copies[-1].fall_through = last
+    copies.append(last)
+    preheader.fall_through = copies[0]
+    last.fall_through = header.branch
+    replace = {instruction.instruction_id: values[instruction.instruction_id] for instruction in header.instruction_list[:-1]}
+    removed = {id(bb) for bb in body}
+    removed.add(id(header))
+    index = ir.bb_list.index(header)
+    ir.bb_list = [bb for bb in ir.bb_list[:index] if id(bb) not in removed] + copies + \
+                 [bb for bb in ir.bb_list[index:] if id(bb) not in removed]
+    finish(ir, header, last, replace, {id(bb) for bb in copies})
+
+# bound for the header compare that leaves the loop after count // unroll_factor trips of
+# unroll_factor steps each, None if there is none near the value the variable has then
+def exitBound(ir, header, blocks: List, count: int, compare, phi) -> Optional[int]:
+    op_code = header.instruction_list[-1].op_code
+    start = ir.constant_values[phi.operant1]
+    stride = inductionVariables(ir, header, blocks)[phi.instruction_id] * unroll_factor
+    iterations = count // unroll_factor
+    for bound in (start + iterations * stride + delta for delta in (0, -1, 1)):
+        if exits(op_code, compare, phi.instruction_id, start + iterations * stride, bound) and \
+                not any(exits(op_code, compare, phi.instruction_id, start + iteration * stride, bound) for iteration in range(iterations)):
+            return bound
+    return None
+
+# the loop runs unroll_factor copies of its body per iteration and leaves when fewer than that
+# are left, a new compare against bound decides it
+# the iterations left run as copies between the header and the block the loop exited to
+def unrollPartially(ir, header, body: List, count: int, compare, phi, bound: int, seen: Dict[int, Any]):
+    branch = header.instruction_list[-1]
+    operants = [compare.operant1, compare.operant2]
+    operants[1 if compare.operant1 == phi.instruction_id else 0] = ir.immediate(bound)
+    exit_compare = smpl_parser.Instruction(ir.pc, "cmp", *operants)
+    ir.pc += 1
+    header.instruction_list.insert(len(header.instruction_list) - 1, exit_compare)
+    branch.operant1 = exit_compare.instruction_id
+    phis = [instruction for instruction in header.instruction_list if instruction.op_code == "phi"]
+    values = {}
+    copies = copyIterations(ir, header, body, phis, values, unroll_factor, False, seen)
+    copies[-1].instruction_list.append(smpl_parser.Instruction(ir.pc, "bra", header.instruction_list[0].instruction_id))
+    ir.pc += 1
+    copies[-1].branch = header
+    # the remainder copies the body with the back edge operants it had
+    following = values
+    values = {}
+    remainder = copyIterations(ir, header, body, phis, values, count % unroll_factor, False, seen)
+    last = header
+    replace = {}
+    if remainder:
+        last = copyHeader(ir, header, values)
+        remainder[-1].fall_through = last
+        last.fall_through = header.branch
+        remainder.append(last)
+        header.branch = remainder[0]
+        replace = {instruction.instruction_id: values[instruction.instruction_id] for instruction in header.instruction_list[:-1]}
+    header.fall_through = copies[0]
+    for instruction in phis:
+        instruction.operant2 = following[instruction.instruction_id]
+    removed = {id(bb) for bb in body}
+    index = ir.bb_list.index(header) + 1
+    ir.bb_list = [bb for bb in ir.bb_list[:index] if id(bb) not in removed] + copies + remainder + \
+                 [bb for bb in ir.bb_list[index:] if id(bb) not in removed]
+    inside = {id(bb) for bb in copies + remainder}
+    inside.add(id(header))
+    finish(ir, header, last, replace, inside)
+
+# values of the header phis for the next copy, from the values the last one gave their back edge operants
+def advance(values: Dict[int, int], phis: List):
+    following = {phi.instruction_id: values.get(phi.operant2, phi.operant2) for phi in phis}
+    values.update(following)
+
+# count copies of the loop one after the other, the first without the header unless with_header
+# values: ids of the loop mapped to those of the copy before, the phis to their values in the first
+# return the blocks in order
+def copyIterations(ir, header, body: List, phis: List, values: Dict[int, int], count: int, with_header: bool, seen: Dict[int, Any]) -> List:
+    copies = []
+    for position in range(count):
+        blocks = copyIteration(ir, header, body, values, with_header or position > 0, seen)
+        if copies:
+            copies[-1].fall_through = blocks[0]
+        copies.extend(blocks)
+        advance(values, phis)
+    return copies
+
+# copy of the header instructions but its phis and branch, falling through into nothing yet
+def copyHeader(ir, header, values: Dict[int, int]):
+    copy = smpl_parser.Basic_Block(0)
+    copy.ssa_table = smpl_parser.SSATable(header.ssa_table)
+    for instruction in header.instruction_list[:-1]:
+        if instruction.op_code != "phi":
+            copyInstruction(ir, instruction, values, copy)
+    return copy
+
+# copy of one trip through the loop, a copy of the header first when with_header is set,
+# and the body whose latch lost its bra and falls through into nothing yet
+# values maps ids of the loop to those of the copy, copies of seen headers are seen too
+# return the blocks of the copy in order, the latch last
+def copyIteration(ir, header, body: List, values: Dict[int, int], with_header: bool, seen: Dict[int, Any]) -> List:
+    blocks = {}
+    copies = []
+    if with_header:
+        copy = copyHeader(ir, header, values)
+        blocks[id(header)] = copy
+        copies.append(copy)
+    phis = []
+    for source in body:
+        copy = smpl_parser.Basic_Block(0)
+        copy.ssa_table = smpl_parser.SSATable(source.ssa_table)
+        blocks[id(source)] = copy
+        copies.append(copy)
+        if id(source) in seen:
+            seen[id(copy)] = copy
+        for instruction in source.instruction_list:
+            clone = copyInstruction(ir, instruction, values, copy)
+            if clone is not None and clone.op_code == "phi":
+                phis.append((clone, instruction))
+    # phis of inner loops refer forward along their back edge, to values of this copy
+    for clone, instruction in phis:
+        clone.operant2 = values.get(instruction.operant2, instruction.operant2)
+    latch = copies[-1]
+    latch.instruction_list.pop()
+    for source in [header] + body:
+        copy = blocks.get(id(source))
+        if copy is None or copy is latch:
+            continue
+        copy.branch = blocks.get(id(source.branch))
+        copy.fall_through = blocks.get(id(source.fall_through))
+        if source.parents is not None:
+            copy.parents = [blocks[id(parent)] for parent in source.parents if id(parent) in blocks]
+    return copies
+
+# copy instruction to the end of block, operants mapped by values, arithmetic on consts becomes a const
+# branch targets are set once the blocks are linked, the back edge operant of a phi once the
+# whole copy is, until then values maps it to the copy before
+# return the copy, None when it folded
+def copyInstruction(ir, instruction, values: Dict[int, int], block):
+    op_code = instruction.op_code
+    operant1, operant2 = instruction.operant1, instruction.operant2
+    if op_code not in ("kill", "call", "bra"):
+        operant1 = values.get(operant1, operant1)
+        if op_code not in smpl_parser.branch_operators and op_code != "phi":
+            operant2 = values.get(operant2, operant2)
+    if op_code in smpl_parser.arithmetic_operators:
+        constants = (ir.constant_values.get(operant1), ir.constant_values.get(operant2))
+        if all(type(constant) == int for constant in constants):
+            value = smpl_parser.evaluate(op_code, *constants)
+            if value is not None:
+                values[instruction.instruction_id] = ir.immediate(value)
+                return None
+    clone = smpl_parser.Instruction(ir.pc, op_code, operant1, operant2)
+    ir.pc += 1
+    values[instruction.instruction_id] = clone.instruction_id
+    if instruction.instruction_id in ir.memory_access:
+        ir.memory_access[clone.instruction_id] = ir.memory_access[instruction.instruction_id]
+    block.instruction_list.append(clone)
+    return clone
+
+# number the blocks again, point branches of the copies at their targets and replace uses of
+# header values after the loop by the values of its last header copy
+# inside: ids of the blocks using the header values themselves
+def finish(ir, header, last, replace: Dict[int, int], inside: Set[int]):
+    for bb_id, bb in enumerate(ir.bb_list):
+        bb.bb_id = bb_id
+    ir.bb_count = len(ir.bb_list) - 1
+    for bb in ir.bb_list:
+        if bb.parents is not None:
+            bb.parents = [last if parent is header else parent for parent in bb.parents]
+        if id(bb) in inside and bb.branch is not None and bb.instruction_list:
+            branch = bb.instruction_list[-1]
+            if branch.op_code == "bra":
+                branch.operant1 = ir.firstInstructionId(bb.branch, branch.operant1)
+            elif branch.op_code in smpl_parser.branch_operators:
+                branch.operant2 = ir.firstInstructionId(bb.branch, branch.operant2)
+        if id(bb) in inside or not replace:
+            continue
+        # replace maps once, the remainder may give a header value that of another header instruction
+        for instruction in bb.instruction_list:
+            if instruction.op_code in ("kill", "const", "call", "arg", "bra"):
+                continue
+            instruction.operant1 = replace.get(instruction.operant1, instruction.operant1)
+            if instruction.op_code not in smpl_parser.branch_operators:
+                instruction.operant2 = replace.get(instruction.operant2, instruction.operant2)
+        for ident, inst_id in list(bb.ssa_table.definitions.items()):
+            if type(inst_id) == int:
+                bb.ssa_table[ident] = replace.get(inst_id, inst_id)
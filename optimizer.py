@@ -0,0 +1,41 @@
+from typing import *
+import constant_folding
+import dead_code
+import inlining
+import loop_invariant
+import loop_unrolling
+import strength_reduction
+
+# pass name: function taking the ir and returning its counts
+passes = {
+    "inline": inlining.inlineFunctions,
+    "fold": constant_folding.foldConstants,
+    "dce": dead_code.eliminateDeadCode,
+    "licm": loop_invariant.hoistInvariants,
+    "unroll": loop_unrolling.unrollLoops,
+    "addresses": strength_reduction.reduceAddresses,
+    "induction": strength_reduction.reduceMultiplies,
+}
+# passes taking the whole program, the others run on main and on every function
+program_passes = {"inline"}
+# passes run by -O, in order
+default_passes = ["inline", "fold", "unroll", "fold", "licm", "addresses", "induction", "dce"]
+
+# run passes over the ir in the given order
+# return pass name: counts it reported, summed over the functions
+def optimize(ir, names: List[str] = None) -> Dict[str, dict]:
+    if names is None:
+        names = default_passes
+    results = {}
+    for name in names:
+        if name not in passes:
+            raise Exception(f"unknown pass {name}")
+        if name in program_passes:
+            results[name] = passes[name](ir)
+            continue
+        counts = {}
+        for function in ir.withFunctions():
+            for key, count in passes[name](function).items():
+                counts[key] = counts.get(key, 0) + count
+        results[name] = counts
+    return results
@@ -0,0 +1,82 @@
+import sys
+import argparse
+from typing import *
+import smpl_parser
+import optimizer
+import register_allocation
+import python_backend
+import vm
+
+# program: numbers it reads and the output it must print, the samples and loop nests the optimizer rewrites
+programs = {
+    "sample0": ([5], "10 0 "),
+    "sample1": ([5], "6 5 "),
+    "sample2": ([5], "9 10 5 6 "),
+    # an inner loop with an unknown trip count in an outer one that unrolls
+    "sample3": ([5], "15 "),
+    # the same with the inner loop stepping by input
+    "sample4": ([3] * 16, "3 6 9 12 15 18 3 6 9 12 15 18 "),
+    # functions reading and writing scalars of main through their memory slots
+    "sample5": ([5], "5 2 12 20 12 2 23 6 20 2 \n"),
+    # a main scalar stored again with the value it had before a call changed it
+    "sample6": ([5], "0 "),
+    # values far past 64 bits in registers and memory, both back ends keep them exact
+    "sample7": ([7], "0 1000 "),
+}
+# pass lists compared with the unoptimized program, None for the default ones
+pass_lists = [None, ["unroll"], ["inline", "fold", "unroll"], ["fold", "licm", "dce"], ["fold", "licm", "addresses", "induction", "dce"]]
+# instructions one run may execute, a loop broken by a pass runs into it
+step_limit = 1 << 20
+
+# output of the program in filename, compiled with passes or unoptimized, or the error it stopped with
+def run(filename: str, numbers: List[int], passes: List[str] = None, optimize: bool = False,
+        registers: int = None, backend: bool = False) -> str:
+    ir = smpl_parser.compileFile(filename)
+    if optimize:
+        optimizer.optimize(ir, passes)
+    output = []
+    try:
+        if backend:
+            python_backend.CompiledProgram.fromIR(ir).run(vm.listReader(numbers), output.append)
+        else:
+            allocation = register_allocation.allocateRegisters(ir, registers) if registers is not None else None
+            vm.VM(ir, reader=vm.listReader(numbers), writer=output.append, allocation=allocation).run(step_limit)
+    except Exception as error:
+        output.append(f"error: {error}")
+    return "".join(output)
+
+# run every program unoptimized and after every pass list on the vm, after the default passes
+# on allocated registers and with the python backend, report the ones that print something else
+# the unoptimized run of a program with a known output must print it, a front end bug shows on both sides
+# return the number of differences
+def check(filenames: List[str]) -> int:
+    differences = 0
+    for filename in filenames:
+        numbers, known = programs.get(filename, ([], None))
+        expected = run(filename, numbers)
+        if known is not None and expected != known:
+            differences += 1
+            print(f"{filename} unoptimized: {expected!r}, expected {known!r}")
+            expected = known
+        variants = {",".join(passes or optimizer.default_passes): run(filename, numbers, passes, True) for passes in pass_lists}
+        variants["registers 4"] = run(filename, numbers, None, True, registers=4)
+        # compiled python has no step limit, it only runs code the vm ran to the end
+        if variants[",".join(optimizer.default_passes)] == expected:
+            variants["python"] = run(filename, numbers, None, True, backend=True)
+        for name, output in variants.items():
+            if output != expected:
+                differences += 1
+                print(f"{filename} {name}: {output!r}, expected {expected!r}")
+        print(f"{filename}: {len(variants)} variants checked")
+    return differences
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="check optimized and unoptimized runs of SMPL programs against their expected output")
+    argument_parser.add_argument("filenames", nargs="*", default=list(programs), help="programs to check, default the samples")
+    args = argument_parser.parse_args()
+    sys.exit(1 if check(args.filenames) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import sys
+import time
+import atexit
+from typing import *
+
+# methods timed once a profiler is attached, they are replaced on the instance only
+ir_methods = ["addBB", "addInstruction", "addLoadInstruction", "addAddaInstruction", "addPhi",
+              "reserveWhilePhi", "updateWhilePhi", "rewriteRegion", "computeDominators", "toGraph", "printSSA"]
+value_table_methods = ["enter", "push"]
+
+# compiler instrumentation, off unless a Profiler is passed to Parser or IR
+# timers accumulate seconds and calls per name, nested timers are inclusive
+# counters are bumped by the compiler where the event happens
+class Profiler:
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add(self, name: str, seconds: float):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    # function wrapped to record its time under name
+    def timed(self, name: str, function: Callable) -> Callable:
+        clock = time.perf_counter
+        add = self.add
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add(name, clock() - start)
+        return wrapper
+
+    # time the ir methods of one ir and its value table
+    def attach(self, ir):
+        for name in ir_methods:
+            setattr(ir, name, self.timed(name, getattr(ir, name)))
+        for name in value_table_methods:
+            setattr(ir.value_table, name, self.timed("ValueTable." + name, getattr(ir.value_table, name)))
+
+    def report(self) -> dict:
+        return {
+            "timers": {name: {"seconds": self.seconds[name], "calls": self.calls[name]} for name in self.seconds},
+            "counters": dict(self.counters),
+        }
+
+    def format(self) -> str:
+        lines = [f"{'timer (inclusive)':32} {'calls':>10} {'seconds':>10} {'us/call':>10}"]
+        for name in sorted(self.seconds, key=self.seconds.get, reverse=True):
+            seconds, calls = self.seconds[name], self.calls[name]
+            lines.append(f"{name:32} {calls:10} {seconds:10.4f} {seconds / calls * 1e6:10.2f}")
+        lines.append(f"{'counter':32} {'value':>10}")
+        for name in sorted(self.counters):
+            lines.append(f"{name:32} {self.counters[name]:10}")
+        return "\n".join(lines) + "\n"
+
+    # write the report when the interpreter exits, stderr by default
+    def dumpAtExit(self, target = None):
+        atexit.register(lambda: (target if target is not None else sys.stderr).write(self.format()))
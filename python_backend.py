@@ -0,0 +1,289 @@
+import sys
+import time
+import marshal
+import hashlib
+import argparse
+from typing import *
+import smpl_parser
+import optimizer
+import vm
+from def_use import DefUse
+
+# python comparison of a branch taken on a compare result
+branch_comparisons = {"bne": "!=", "beq": "==", "ble": "<=", "blt": "<", "bge": ">=", "bgt": ">"}
+# blocks with one predecessor are generated inside it, deeper than this they are dispatched
+max_nesting = 40
+indent = "    "
+
+# div truncating toward zero like evaluate, a zero divisor raises ZeroDivisionError
+def div(left: int, right: int) -> int:
+    quotient = abs(left) // abs(right)
+    return quotient if (left < 0) == (right < 0) else -quotient
+
+# memory past the arrays lives in spill, address: value, and reads 0 until stored
+def loadOutside(spill: Dict[int, int], address: int) -> int:
+    if address < 0:
+        raise Exception(f"load from negative address {address}")
+    return spill.get(address, 0)
+
+def storeOutside(spill: Dict[int, int], address: int, value: int):
+    if address < 0:
+        raise Exception(f"store to negative address {address}")
+    spill[address] = value
+
+# names the generated code finds as globals
+runtime = {"div": div, "loadOutside": loadOutside, "storeOutside": storeOutside}
+
+# python source of an ir, main is a function program(read, write) with the semantics of vm.VM
+# and every function one named function_<symbol id> taking the memory and its parameters
+# values are locals named after their instruction id, consts are inlined as literals
+# memory is one list of words holding python ints as in the vm, arrays laid out as by vm.arrayLayout
+# blocks entered from more than one edge are regions of a dispatch loop on the block number,
+# the others are generated in place at their only entry, phis become parallel assignments on the edges
+class SourceGenerator:
+    def __init__(self, ir, addresses: Dict[str, int], memory_words: int):
+        self.ir = ir
+        self.chains = DefUse(ir)
+        self.predecessors = ir.predecessors()
+        self.memory_words = memory_words
+        # const id: python literal
+        self.literals: Dict[int, str] = {}
+        for instruction in ir.bb_list[0].instruction_list:
+            if instruction.op_code == "const":
+                value = instruction.operant1
+                self.literals[instruction.instruction_id] = str(value if type(value) == int else addresses[value])
+        self.lines: List[str] = []
+        # blocks that are dispatch regions, in the order they were found
+        self.regions: List["smpl_parser.Basic_Block"] = []
+        self.region_ids: Set[int] = set()
+        # ids of the values read, they start as 0
+        self.read_names: Set[int] = set()
+
+    def operant(self, operant) -> str:
+        if type(operant) != int:
+            # "#BASE" is address 0, a missing operant reads 0
+            return "0"
+        literal = self.literals.get(operant)
+        if literal is not None:
+            return literal
+        if self.chains.definition(operant) is None:
+            return "0"
+        self.read_names.add(operant)
+        return f"v{operant}"
+
+    def emit(self, depth: int, line: str):
+        self.lines.append(indent * depth + line)
+
+    def region(self, bb) -> int:
+        if id(bb) not in self.region_ids:
+            self.region_ids.add(id(bb))
+            self.regions.append(bb)
+        return bb.bb_id
+
+    # statements of bb at depth, then the edges leaving it
+    def block(self, bb, depth: int):
+        instructions = bb.instruction_list
+        compares = {}
+        params = []
+        for instruction in instructions:
+            op_code = instruction.op_code
+            target = f"v{instruction.instruction_id}"
+            if op_code in ("const", "phi", "kill"):
+                continue
+            if op_code == "call":
+                arguments = "".join(f", {param}" for param in params[len(params) - instruction.operant2:])
+                self.emit(depth, f"{target} = function_{instruction.operant1}(read, write, memory, spill{arguments})")
+                params = []
+                continue
+            if op_code == "arg":
+                self.emit(depth, f"{target} = a{instruction.operant1}")
+                continue
+            left, right = self.operant(instruction.operant1), self.operant(instruction.operant2)
+            if op_code == "param":
+                params.append(left)
+                continue
+            if op_code == "add" or op_code == "adda":
+                self.emit(depth, f"{target} = {left} + {right}")
+            elif op_code == "sub":
+                self.emit(depth, f"{target} = {left} - {right}")
+            elif op_code == "mul":
+                self.emit(depth, f"{target} = {left} * {right}")
+            elif op_code == "div":
+                self.emit(depth, f"{target} = div({left}, {right})")
+            elif op_code == "cmp":
+                compares[instruction.instruction_id] = (left, right)
+                # a compare read by its branch only is folded into the branch
+                users = self.chains.users.get(instruction.instruction_id, [])
+                if not (len(users) == 1 and users[0] is instructions[-1] and users[0].op_code in branch_comparisons):
+                    self.emit(depth, f"{target} = ({left} > {right}) - ({left} < {right})")
+            elif op_code == "load":
+                self.emit(depth, f"{target} = memory[{left} >> 2] if 0 <= {left} < {self.memory_words * 4} else loadOutside(spill, {left})")
+            elif op_code == "store":
+                self.emit(depth, f"if 0 <= {left} < {self.memory_words * 4}:")
+                self.emit(depth + 1, f"memory[{left} >> 2] = {right}")
+                self.emit(depth, "else:")
+                self.emit(depth + 1, f"storeOutside(spill, {left}, {right})")
+            elif op_code == "read":
+                self.emit(depth, f"{target} = read()")
+            elif op_code == "write":
+                self.emit(depth, f"write(str({left}) + \" \")")
+            elif op_code == "writeNL":
+                self.emit(depth, "write(\"\\n\")")
+            elif op_code == "end" or op_code == "ret":
+                self.emit(depth, f"return {left}" if self.ir.name is not None else "return")
+                return
+            elif op_code == "bra":
+                self.edge(bb, bb.branch, depth)
+                return
+            elif op_code in branch_comparisons:
+                comparison = branch_comparisons[op_code]
+                if instruction.operant1 in compares:
+                    left, right = compares[instruction.operant1]
+                    self.emit(depth, f"if {left} {comparison} {right}:")
+                else:
+                    self.emit(depth, f"if {left} {comparison} 0:")
+                self.edge(bb, bb.branch, depth + 1)
+                break
+            else:
+                raise Exception(f"cannot translate {op_code}")
+        if bb.fall_through is None:
+            self.emit(depth, "return 0" if self.ir.name is not None else "return")
+        else:
+            self.edge(bb, bb.fall_through, depth)
+
+    # phi assignments of entering target from source, then target in place or a jump to its region
+    def edge(self, source, target, depth: int):
+        phis = [instruction for instruction in target.instruction_list if instruction.op_code == "phi"]
+        if phis:
+            second = smpl_parser.endsWithBra(source)
+            names = ", ".join(f"v{phi.instruction_id}" for phi in phis)
+            values = ", ".join(self.operant(phi.operant2 if second else phi.operant1) for phi in phis)
+            self.emit(depth, f"{names} = {values}")
+        if len(self.predecessors[id(target)]) == 1 and depth < max_nesting and target is not self.ir.bb_list[0]:
+            self.block(target, depth)
+        else:
+            self.emit(depth, f"block = {self.region(target)}")
+            self.emit(depth, "continue")
+
+    # regions are found while generating, each one may find more
+    def generate(self) -> str:
+        self.region(self.ir.bb_list[0])
+        bodies = {}
+        index = 0
+        while index < len(self.regions):
+            bb = self.regions[index]
+            index += 1
+            self.lines = []
+            self.block(bb, 0)
+            bodies[bb.bb_id] = self.lines
+        self.lines = []
+        names = [f"v{instruction_id}" for instruction_id in sorted(self.read_names)]
+        if self.ir.name is None:
+            self.emit(0, "def program(read, write):")
+            self.emit(1, f"memory = [0] * {self.memory_words}")
+            self.emit(1, "spill = {}")
+        else:
+            parameters = "".join(f", a{index}" for index in range(len(self.ir.params)))
+            self.emit(0, f"def function_{self.ir.name}(read, write, memory, spill{parameters}):")
+        # values read before their instruction ran are 0, as in the vm
+        for start in range(0, len(names), 32):
+            self.emit(1, " = ".join(names[start:start + 32]) + " = 0")
+        self.emit(1, f"block = {self.ir.bb_list[0].bb_id}")
+        self.emit(1, "while True:")
+        self.dispatch(sorted(bodies), bodies, 2)
+        return "\n".join(self.lines) + "\n"
+
+    # binary search over the region numbers
+    def dispatch(self, keys: List[int], bodies: Dict[int, List[str]], depth: int):
+        if len(keys) == 1:
+            for line in bodies[keys[0]]:
+                self.lines.append(indent * depth + line)
+            return
+        middle = len(keys) // 2
+        self.emit(depth, f"if block < {keys[middle]}:")
+        self.dispatch(keys[:middle], bodies, depth + 1)
+        self.emit(depth, "else:")
+        self.dispatch(keys[middle:], bodies, depth + 1)
+
+# the functions first, then program
+def generateSource(ir) -> str:
+    addresses, memory_words = vm.arrayLayout(ir)
+    return "\n".join(SourceGenerator(function, addresses, memory_words).generate()
+                     for function in ir.withFunctions()[1:] + [ir])
+
+# code objects of sources compiled in this process, sha256 of the source: code
+code_cache: Dict[str, Any] = {}
+
+def compileSource(source: str):
+    key = hashlib.sha256(source.encode()).hexdigest()
+    code = code_cache.get(key)
+    if code is None:
+        code = compile(source, f"<smpl {key[:12]}>", "exec")
+        code_cache[key] = code
+    return code
+
+# an ir translated and compiled once, run as often as needed
+# the code object round trips through toBytes and fromBytes on the same python version
+class CompiledProgram:
+    def __init__(self, code, source: str = None):
+        self.code = code
+        self.source = source
+        namespace = dict(runtime)
+        exec(code, namespace)
+        self.function = namespace["program"]
+
+    @classmethod
+    def fromIR(cls, ir) -> "CompiledProgram":
+        source = generateSource(ir)
+        return cls(compileSource(source), source)
+
+    def toBytes(self) -> bytes:
+        return marshal.dumps(self.code)
+
+    @classmethod
+    def fromBytes(cls, data: bytes) -> "CompiledProgram":
+        return cls(marshal.loads(data))
+
+    # reader and writer as for vm.VM
+    def run(self, reader: Callable[[], int] = None, writer: Callable[[str], Any] = None):
+        self.function(reader if reader is not None else vm.streamReader(sys.stdin),
+                      writer if writer is not None else sys.stdout.write)
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="compile an SMPL program to python and run it")
+    argument_parser.add_argument("filename")
+    argument_parser.add_argument("-O", "--optimize", action="store_true", help="run the default optimization passes")
+    argument_parser.add_argument("--passes", default=None, help="comma separated optimization passes to run, in order")
+    argument_parser.add_argument("--input", default=None, help="file with the numbers to read, default stdin")
+    argument_parser.add_argument("--source", default=None, help="write the generated python source, - for stdout, and stop")
+    argument_parser.add_argument("--stats", action="store_true", help="report translation and run times on stderr")
+    args = argument_parser.parse_args()
+
+    ir = smpl_parser.compileFile(args.filename)
+    if args.passes:
+        optimizer.optimize(ir, args.passes.split(","))
+    elif args.optimize:
+        optimizer.optimize(ir)
+    start = time.perf_counter()
+    program = CompiledProgram.fromIR(ir)
+    translated = time.perf_counter()
+    if args.source:
+        if args.source == "-":
+            sys.stdout.write(program.source)
+        else:
+            with open(args.source, "w") as file:
+                file.write(program.source)
+        return
+    input_file = open(args.input) if args.input else sys.stdin
+    try:
+        program.run(reader=vm.streamReader(input_file))
+    finally:
+        sys.stdout.flush()
+        if args.input:
+            input_file.close()
+    if args.stats:
+        sys.stderr.write(f"translated in {translated - start:.4f} s, ran in {time.perf_counter() - translated:.4f} s\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+import html
+import heapq
+from typing import *
+import smpl_parser
+from def_use import valueOperants
+
+# operators producing a value that needs a location, consts stay immediates
+value_operators = {"add", "sub", "mul", "div", "cmp", "adda", "load", "read", "phi", "call", "arg"}
+# colours of the dot view, register n gets palette[n % len(palette)]
+palette = ["red", "blue", "darkgreen", "darkorange", "purple", "brown", "deeppink", "teal",
+           "olive", "navy", "crimson", "darkviolet", "sienna", "seagreen", "goldenrod", "slategray"]
+
+# result of allocating an ir to a fixed number of registers
+# locations: value id: location, registers are 0 to registers - 1, spill slot n is registers + n
+# and scratch, one past the last spill slot, breaks cycles of phi moves
+# moves: (predecessor bb id, bb id): (destination, source) copies doing the phis of that edge in order,
+# a source is a location or a const instruction id given as ("#", id)
+class Allocation:
+    def __init__(self, ir, registers: int):
+        self.ir = ir
+        self.registers = registers
+        self.locations: Dict[int, int] = {}
+        self.spill_slots = 0
+        self.coalesced = 0
+        self.moves: Dict[Tuple[int, int], List[Tuple[int, Any]]] = {}
+        # const id: its value, operants without a location read these or 0
+        self.constants: Dict[int, Any] = {instruction.instruction_id: instruction.operant1
+                                          for instruction in ir.bb_list[0].instruction_list if instruction.op_code == "const"}
+
+    @property
+    def scratch(self) -> int:
+        return self.registers + self.spill_slots
+
+    def spilled(self) -> int:
+        return sum(1 for location in self.locations.values() if location >= self.registers)
+
+    def locationName(self, location: int) -> str:
+        if location < self.registers:
+            return f"R{location}"
+        if location == self.scratch:
+            return "T"
+        return f"M{location - self.registers}"
+
+    # text of an operant, a location, an immediate or "#BASE"
+    def operantName(self, operant) -> str:
+        if type(operant) != int:
+            return str(operant) if operant is not None else "#0"
+        location = self.locations.get(operant)
+        if location is not None:
+            return self.locationName(location)
+        return f"#{self.constants.get(operant, 0)}"
+
+    def sourceName(self, source) -> str:
+        if type(source) == tuple:
+            return self.operantName(source[1])
+        return self.locationName(source)
+
+    def instructionString(self, bb, instruction) -> str:
+        op_code = instruction.op_code
+        if op_code == "kill":
+            return f"kill ({self.ir.symbols.name(instruction.operant1)})"
+        if op_code == "bra":
+            return f"bra BB{bb.branch.bb_id}" if bb.branch else "bra"
+        if op_code == "call" or op_code == "arg":
+            text = f"call {self.ir.symbols.name(instruction.operant1)}" if op_code == "call" else f"arg {instruction.operant1}"
+            location = self.locations.get(instruction.instruction_id)
+            return f"{self.locationName(location)} = {text}" if location is not None else text
+        if op_code in smpl_parser.branch_operators:
+            return f"{op_code} {self.operantName(instruction.operant1)} BB{bb.branch.bb_id}" if bb.branch else op_code
+        operants = " ".join(self.operantName(operant) for operant in (instruction.operant1, instruction.operant2) if operant is not None)
+        text = f"{op_code} {operants}" if operants else op_code
+        location = self.locations.get(instruction.instruction_id)
+        return f"{self.locationName(location)} = {text}" if location is not None else text
+
+    def moveStrings(self, moves: List[Tuple[int, Any]]) -> List[str]:
+        return [f"{self.locationName(destination)} <- {self.sourceName(source)}" for destination, source in moves]
+
+    # allocated ir, phis are gone and their moves are listed with the edge they belong to
+    def toString(self) -> str:
+        lines = []
+        for bb in self.ir.bb_list:
+            lines.append(f"BB{bb.bb_id}:")
+            for instruction in bb.instruction_list:
+                if instruction.op_code != "phi" and instruction.op_code != "const":
+                    lines.append(f"    {self.instructionString(bb, instruction)}")
+            for child in self.ir.successors(bb):
+                moves = self.moves.get((bb.bb_id, child.bb_id))
+                if moves:
+                    lines.append(f"    to BB{child.bb_id}: " + ", ".join(self.moveStrings(moves)))
+        return "\n".join(lines) + "\n"
+
+    # dot view, every instruction in the colour of its register, spilled values in black
+    # edges carry the moves of their phis
+    def toDot(self) -> str:
+        lines = ["digraph G{"]
+        for bb in self.ir.bb_list:
+            rows = [f"<tr><td><b>BB{bb.bb_id}</b></td></tr>"]
+            for instruction in bb.instruction_list:
+                if instruction.op_code == "phi" or instruction.op_code == "const":
+                    continue
+                text = html.escape(self.instructionString(bb, instruction))
+                location = self.locations.get(instruction.instruction_id)
+                if location is not None and location < self.registers:
+                    text = f'<font color="{palette[location % len(palette)]}">{text}</font>'
+                rows.append(f'<tr><td align="left">{text}</td></tr>')
+            lines.append(f'bb{bb.bb_id}[shape=plaintext, label=<<table border="0" cellborder="1" cellspacing="0">{"".join(rows)}</table>>];')
+        for bb in self.ir.bb_list:
+            for child, kind in ((bb.branch, "branch"), (bb.fall_through, "fall-through")):
+                if child is None:
+                    continue
+                label = "\\n".join([kind] + self.moveStrings(self.moves.get((bb.bb_id, child.bb_id), [])))
+                lines.append(f'bb{bb.bb_id} -> bb{child.bb_id} [label="{label}"];')
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+# the phi operant read on the edge from predecessor, operant2 after a bra
+def phiOperant(phi, predecessor):
+    return phi.operant2 if smpl_parser.endsWithBra(predecessor) else phi.operant1
+
+# values live on entry to and exit from every block, by block id
+# a phi operant is live out of the predecessor it comes from, a phi is defined on entry to its block
+def liveness(ir, values: Set[int]) -> Tuple[Dict[int, Set[int]], Dict[int, Set[int]]]:
+    exposed = {}
+    defined = {}
+    phis = {}
+    for bb in ir.bb_list:
+        uses = set()
+        definitions = set()
+        for instruction in reversed(bb.instruction_list):
+            if instruction.op_code == "phi":
+                definitions.add(instruction.instruction_id)
+                uses.discard(instruction.instruction_id)
+                continue
+            if instruction.instruction_id in values:
+                definitions.add(instruction.instruction_id)
+                uses.discard(instruction.instruction_id)
+            uses.update(operant for operant in valueOperants(instruction) if operant in values)
+        exposed[id(bb)] = uses
+        defined[id(bb)] = definitions
+        phis[id(bb)] = [instruction for instruction in bb.instruction_list if instruction.op_code == "phi"]
+    live_in = {id(bb): set() for bb in ir.bb_list}
+    live_out = {id(bb): set() for bb in ir.bb_list}
+    changed = True
+    while changed:
+        changed = False
+        for bb in reversed(ir.bb_list):
+            out = set()
+            for child in ir.successors(bb):
+                out |= live_in[id(child)]
+                for phi in phis[id(child)]:
+                    operant = phiOperant(phi, bb)
+                    if operant in values:
+                        out.add(operant)
+            entry = exposed[id(bb)] | (out - defined[id(bb)])
+            if len(out) != len(live_out[id(bb)]) or len(entry) != len(live_in[id(bb)]):
+                live_out[id(bb)] = out
+                live_in[id(bb)] = entry
+                changed = True
+    return live_in, live_out
+
+# value id: ids of the values live where it is defined
+def interferenceGraph(ir, values: Set[int], live_out: Dict[int, Set[int]]) -> Dict[int, Set[int]]:
+    graph = {value: set() for value in values}
+
+    def interfere(value, live):
+        neighbours = graph[value]
+        neighbours.update(live)
+        for other in live:
+            graph[other].add(value)
+        neighbours.discard(value)
+
+    for bb in ir.bb_list:
+        live = set(live_out[id(bb)])
+        phis = []
+        for instruction in reversed(bb.instruction_list):
+            if instruction.op_code == "phi":
+                phis.append(instruction.instruction_id)
+                continue
+            if instruction.instruction_id in values:
+                live.discard(instruction.instruction_id)
+                interfere(instruction.instruction_id, live)
+            live.update(operant for operant in valueOperants(instruction) if operant in values)
+        # the phis of a block are written together on every edge into it
+        for phi in phis:
+            interfere(phi, live)
+            interfere(phi, phis)
+    return graph
+
+# register allocation by graph colouring
+# phis are coalesced with their operants where that cannot make the graph harder to colour (Briggs),
+# simplify removes values of fewer than registers neighbours, when none is left the one with the
+# most neighbours is pushed optimistically, a value that finds no free register when popped is spilled
+# spilled values share memory slots where they do not interfere
+def allocateRegisters(ir, registers: int = 8) -> Allocation:
+    if registers < 1:
+        raise Exception("at least one register is needed")
+    values = {instruction.instruction_id for bb in ir.bb_list for instruction in bb.instruction_list
+              if instruction.op_code in value_operators}
+    _, live_out = liveness(ir, values)
+    graph = interferenceGraph(ir, values, live_out)
+    allocation = Allocation(ir, registers)
+
+    # union find over coalesced values, the root owns the merged neighbours
+    leader = {value: value for value in values}
+
+    def find(value):
+        while leader[value] != value:
+            leader[value] = leader[leader[value]]
+            value = leader[value]
+        return value
+
+    for bb in ir.bb_list:
+        for instruction in bb.instruction_list:
+            if instruction.op_code != "phi":
+                continue
+            for operant in (instruction.operant1, instruction.operant2):
+                if operant not in values:
+                    continue
+                left, right = find(instruction.instruction_id), find(operant)
+                if left == right or right in graph[left]:
+                    continue
+                merged = graph[left] | graph[right]
+                significant = 0
+                for neighbour in merged:
+                    if len(graph[neighbour]) >= registers:
+                        significant += 1
+                        if significant == registers:
+                            break
+                if significant == registers:
+                    continue
+                leader[right] = left
+                for neighbour in graph.pop(right):
+                    graph[neighbour].discard(right)
+                    graph[neighbour].add(left)
+                graph[left] = merged
+                allocation.coalesced += 1
+
+    # simplify
+    degree = {value: len(neighbours) for value, neighbours in graph.items()}
+    removed = set()
+    stack = []
+    low = [value for value in graph if degree[value] < registers]
+    # spill candidates by most neighbours, entries go stale as degrees drop and are pushed again
+    high = [(-degree[value], value) for value in graph if degree[value] >= registers]
+    heapq.heapify(high)
+    while low or high:
+        if low:
+            value = low.pop()
+        else:
+            negative, value = heapq.heappop(high)
+            if value in removed:
+                continue
+            if -negative != degree[value]:
+                heapq.heappush(high, (-degree[value], value))
+                continue
+        if value in removed:
+            continue
+        removed.add(value)
+        stack.append(value)
+        for neighbour in graph[value]:
+            if neighbour in removed:
+                continue
+            degree[neighbour] -= 1
+            if degree[neighbour] == registers - 1:
+                low.append(neighbour)
+
+    # select
+    colour = {}
+    slots = {}
+    while stack:
+        value = stack.pop()
+        taken = {colour[neighbour] for neighbour in graph[value] if neighbour in colour}
+        for register in range(registers):
+            if register not in taken:
+                colour[value] = register
+                break
+        else:
+            used = {slots[neighbour] for neighbour in graph[value] if neighbour in slots}
+            slot = 0
+            while slot in used:
+                slot += 1
+            slots[value] = slot
+    allocation.spill_slots = max(slots.values()) + 1 if slots else 0
+    for value in values:
+        root = find(value)
+        allocation.locations[value] = colour[root] if root in colour else registers + slots[root]
+
+    # phi moves of every edge
+    predecessors = ir.predecessors()
+    for bb in ir.bb_list:
+        phis = [instruction for instruction in bb.instruction_list if instruction.op_code == "phi"]
+        if not phis:
+            continue
+        for predecessor in predecessors[id(bb)]:
+            copies = []
+            for phi in phis:
+                operant = phiOperant(phi, predecessor)
+                source = allocation.locations.get(operant, ("#", operant))
+                destination = allocation.locations[phi.instruction_id]
+                if source != destination:
+                    copies.append((destination, source))
+            if copies:
+                allocation.moves[(predecessor.bb_id, bb.bb_id)] = sequentialMoves(copies, allocation.scratch)
+    ir.diagnostics.phase("registers", f"{registers} registers, {allocation.spilled()} spilled to {allocation.spill_slots} slots, "
+                                      f"{allocation.coalesced} coalesced, {sum(len(moves) for moves in allocation.moves.values())} moves")
+    return allocation
+
+# order parallel copies so no destination is written before it was read, cycles go through scratch
+def sequentialMoves(copies: List[Tuple[int, Any]], scratch: int) -> List[Tuple[int, Any]]:
+    pending = dict(copies)
+    ordered = []
+    while pending:
+        read = {source for source in pending.values()}
+        ready = [destination for destination in pending if destination not in read]
+        if ready:
+            for destination in ready:
+                ordered.append((destination, pending.pop(destination)))
+            continue
+        # every destination is still read by another copy, only cycles are left
+        destination = next(iter(pending))
+        ordered.append((scratch, destination))
+        for other, source in pending.items():
+            if source == destination:
+                pending[other] = scratch
+    return ordered
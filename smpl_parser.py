@@ -1,6 +1,15 @@
 import sys
+import time
+import argparse
 from typing import *
-from tokenizer import Tokenizer
+from tokenizer import Tokenizer, TokenStream
+from diagnostics import Diagnostics, level_names, OFF, PHASE, SSA, TOKEN
+from symbol_table import SymbolTable, INPUT_NUM, OUTPUT_NUM, OUTPUT_NEW_LINE
+from graph_emitter import GraphEmitter, formats, DOT
+import ir_cache
+from profiler import Profiler
+import optimizer
+import register_allocation
 
 # map token to ir operator
 token_operator_map = {
@@ -28,115 +37,417 @@ token_operator_map = {
     25 :"bgt"
 } 
 
+# operators never merged by common subexpression elimination
+# a store may write a value back that a call or another store changed in between
+unnumbered_operators = {"phi", "kill", "store", "bra", "bne", "beq", "ble", "blt", "bge", "bgt", "end", "param", "call", "arg", "ret"}
+# conditional branches, operant2 is the branch target
+branch_operators = {"bne", "beq", "ble", "blt", "bge", "bgt"}
+# operators merged again when a sealed loop rewrites their operants
+renumbered_operators = {"add", "sub", "mul", "div", "cmp", "adda"}
+# operators computed from two values
+arithmetic_operators = {"add", "sub", "mul", "div", "cmp"}
+
+# result of an arithmetic operator, None where it is undefined
+# div truncates toward zero, cmp gives -1, 0 or 1
+def evaluate(op_code: str, left: int, right: int) -> Optional[int]:
+    if op_code == "add":
+        return left + right
+    if op_code == "sub":
+        return left - right
+    if op_code == "mul":
+        return left * right
+    if op_code == "div":
+        if right == 0:
+            return None
+        quotient = abs(left) // abs(right)
+        return quotient if (left < 0) == (right < 0) else -quotient
+    if op_code == "cmp":
+        return (left > right) - (left < right)
+    return None
+
+# conditional branch: taken for a compare result
+branch_conditions = {
+    "bne": lambda value: value != 0,
+    "beq": lambda value: value == 0,
+    "ble": lambda value: value <= 0,
+    "blt": lambda value: value < 0,
+    "bge": lambda value: value >= 0,
+    "bgt": lambda value: value > 0,
+}
+
+# fixed slots, no per-instance __dict__
+# op codes are interned string literals, instances share them
 class Instruction:
+    __slots__ = ("instruction_id", "op_code", "operant1", "operant2")
+
     def __init__(self, instruction_id: int, op_code: str, operant1:int = None, operant2:int = None):
         self.instruction_id = instruction_id
         self.op_code: str = op_code
         self.operant1: int = operant1
         self.operant2: int = operant2
 
-    def toString(self) -> str:
+    # kill names the array, pass the symbol table to print the name instead of the id
+    def toString(self, symbols: SymbolTable = None) -> str:
         if self.op_code == "const":
             return f'{self.instruction_id}: {self.op_code}' + f' #{self.operant1}'
+        if self.op_code == "kill" and symbols is not None:
+            return f'{self.instruction_id}: {self.op_code} ({symbols.name(self.operant1)})'
+        if self.op_code == "call" and symbols is not None:
+            return f'{self.instruction_id}: {self.op_code} {symbols.name(self.operant1)} ({self.operant2})'
         return f'{self.instruction_id}: {self.op_code}' + (f' ({self.operant1})' if self.operant1 is not None else '') + (f' ({self.operant2})' if self.operant2 is not None else '')
 
+# array entry in ssa table
+# stored flag is set by a store and reset by the kill in front of the next load
+class ArrayEntry:
+    __slots__ = ("base_addr", "dimension", "stored")
+
+    def __init__(self, base_addr: int, dimension: List[int], stored: bool = False):
+        self.base_addr: int = base_addr
+        self.dimension: List[int] = dimension
+        self.stored: bool = stored
+
+    def __repr__(self):
+        return repr([self.base_addr, self.dimension, self.stored])
+
+# ssa table of a block
+# a block only keeps its own definitions and resolves everything else through its parent
+# a lookup through the parent is memoized, redefining a variable of a table with children
+# invalidates the memo of every table of the ir
+# chains are cut every flatten_depth tables by copying the visible definitions once
+missing = object()
+
+class SSATable:
+    __slots__ = ("parent", "definitions", "cache", "depth", "epoch", "cache_epoch", "has_children")
+    flatten_depth = 32
+
+    def __init__(self, parent: "SSATable" = None):
+        self.parent: SSATable = parent
+        self.definitions: Dict[int, Union[int, ArrayEntry]] = {}
+        self.cache: Dict[int, Union[int, ArrayEntry]] = {}
+        self.depth: int = 0
+        if parent is not None:
+            self.depth = parent.depth + 1
+            if self.depth >= self.flatten_depth:
+                self.definitions = dict(parent.items())
+                self.depth = 0
+        # shared by every table of one ir
+        self.epoch: List[int] = parent.epoch if parent is not None else [0]
+        self.cache_epoch: int = self.epoch[0]
+        self.has_children: bool = False
+        if parent is not None:
+            parent.has_children = True
+
+    def get(self, id: int, default = None):
+        value = self.definitions.get(id, missing)
+        if value is not missing:
+            return value
+        epoch = self.epoch[0]
+        if self.cache_epoch != epoch:
+            self.cache = {}
+            self.cache_epoch = epoch
+        value = self.cache.get(id, missing)
+        if value is missing:
+            table = self.parent
+            while table is not None:
+                value = table.definitions.get(id, missing)
+                if value is missing and table.cache_epoch == epoch:
+                    value = table.cache.get(id, missing)
+                if value is not missing:
+                    break
+                table = table.parent
+            self.cache[id] = value
+        return default if value is missing else value
+
+    def __getitem__(self, id: int):
+        value = self.get(id, missing)
+        if value is missing:
+            raise KeyError(id)
+        return value
+
+    def __setitem__(self, id: int, value):
+        self.definitions[id] = value
+        if self.has_children:
+            self.epoch[0] += 1
+
+    def __contains__(self, id: int) -> bool:
+        return self.get(id, missing) is not missing
+
+    # every visible variable, in declaration order
+    def items(self):
+        chain = []
+        table = self
+        while table is not None:
+            chain.append(table)
+            table = table.parent
+        merged = {}
+        for table in reversed(chain):
+            merged.update(table.definitions)
+        return merged.items()
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+# variables that may differ between two tables
+# definitions on both chains below their closest common table
+def divergentIdents(left: SSATable, right: SSATable) -> List[int]:
+    idents = set()
+    while left is not right:
+        if right is None or (left is not None and left.depth >= right.depth):
+            idents.update(left.definitions)
+            left = left.parent
+        else:
+            idents.update(right.definitions)
+            right = right.parent
+    return sorted(idents)
+
+# stored flag at a join
+# None means stored depends on a loop that is not sealed yet
+def mergeStored(left: Optional[bool], right: Optional[bool]) -> Optional[bool]:
+    if left is True or right is True:
+        return True
+    if left is None or right is None:
+        return None
+    return False
+
 class Basic_Block:
+    __slots__ = ("bb_id", "branch", "fall_through", "parents", "ssa_table", "instruction_list", "idom", "dom_children", "pre", "last", "values")
+
     def __init__(self, bb_id):
         self.bb_id: int = bb_id
         # at most two children
         self.branch: Basic_Block = None
         self.fall_through: Basic_Block = None
-        # variable name: value instruction number
-        self.ssa_table: Dict[str, int] = {}
+        # predecessors of an if join without else
+        self.parents: List[Basic_Block] = None
+        # variable id: value instruction number or ArrayEntry
+        self.ssa_table: SSATable = SSATable()
         self.instruction_list: List[Instruction] = []
-        # dominator of current block = self and dominator of dominators
-        self.dominator: List[Basic_Block] = []
-        self.dominator.append(self)
+        # immediate dominator and dominator tree children
+        self.idom: Basic_Block = None
+        self.dom_children: List[Basic_Block] = []
+        # dominator tree preorder number and the largest number in the subtree
+        # last is None while blocks can still be added below this one
+        self.pre: int = -1
+        self.last: int = None
+        # (op_code, operant1, operant2): first instruction of this block computing it
+        self.values: Dict[tuple, Instruction] = {}
 
-    def instructionToGraph(self):
-        instruction_str = '|'.join([instruction.toString() for instruction in self.instruction_list])
-        rst = f'bb{self.bb_id}[shape=record, label="<b>BB{self.bb_id}|{{{instruction_str}}}"];'
+    # prefix: put before the node names, it keeps the blocks of different functions apart
+    def instructionToGraph(self, symbols: SymbolTable = None, prefix: str = ""):
+        instruction_str = '|'.join([instruction.toString(symbols) for instruction in self.instruction_list])
+        rst = f'{prefix}bb{self.bb_id}[shape=record, label="<b>BB{self.bb_id}|{{{instruction_str}}}"];'
         return rst
     
-    def branchToGraph(self):
+    def branchToGraph(self, prefix: str = ""):
         if not self.branch:
             return ""
-        rst = f'bb{self.bb_id}:s -> bb{self.branch.bb_id}:n [label="branch"];'
+        rst = f'{prefix}bb{self.bb_id}:s -> {prefix}bb{self.branch.bb_id}:n [label="branch"];'
         return rst
     
-    def fallThroughToGraph(self):
+    def fallThroughToGraph(self, prefix: str = ""):
         if not self.fall_through:
             return ""
-        rst = f'bb{self.bb_id}:s -> bb{self.fall_through.bb_id}:n [label="fall-through"];'
+        rst = f'{prefix}bb{self.bb_id}:s -> {prefix}bb{self.fall_through.bb_id}:n [label="fall-through"];'
         return rst
     
-    def dominatorToGraph(self):
-        rst = ""
-        if not self.dominator:
-            return rst
-        for dominator in self.dominator:
-            if dominator != self:
-                rst += f'bb{dominator.bb_id}:b -> bb{self.bb_id}:b [color=blue, style=dotted, lable="dom"];' + "\n"
+    # dominator tree edge from the immediate dominator
+    def dominatorToGraph(self, prefix: str = ""):
+        if not self.idom:
+            return ""
+        rst = f'{prefix}bb{self.idom.bb_id}:b -> {prefix}bb{self.bb_id}:b [color=blue, style=dotted, label="dom"];'
         return rst
 
-class IR:
+    # self, immediate dominator, its immediate dominator, ...
+    def dominators(self):
+        bb = self
+        while bb is not None:
+            yield bb
+            bb = bb.idom
+
+    # O(1) by dominator tree preorder numbering
+    def dominates(self, other: "Basic_Block") -> bool:
+        if self.pre < 0 or other.pre < self.pre:
+            return False
+        return self.last is None or other.pre <= self.last
+
+# while loop, built in a single pass
+# header phis are created for every variable when the loop is entered
+# and completed when the back edge is known
+class Loop:
+    __slots__ = ("header", "parent", "phis", "entry_stored", "stored", "pending_kills")
+
+    def __init__(self, header: Basic_Block, parent: "Loop" = None):
+        self.header: Basic_Block = header
+        # enclosing loop
+        self.parent: Loop = parent
+        # header phis with the variable they merge
+        self.phis: List[Tuple[Instruction, int]] = []
+        # array id: stored flag on entry, None if it depends on an enclosing loop
+        self.entry_stored: Dict[int, Optional[bool]] = {}
+        # arrays stored anywhere in the loop
+        self.stored: Set[int] = set()
+        # array id: (block, kill) emitted while the stored flag was unknown
+        self.pending_kills: Dict[int, List[Tuple[Basic_Block, Instruction]]] = {}
+
+# value numbering table scoped along the dominator tree
+# the scope stack holds the dominator chain of the current block, farthest first
+# values of every scoped block are merged in one dict, the nearest block wins
+class ValueTable:
     def __init__(self):
+        self.table: Dict[tuple, Instruction] = {}
+        self.scope: List[Basic_Block] = []
+        # per scoped block, key and shadowed instruction pairs to restore on exit
+        # kept flat, a tuple per entry would cost more than the entry
+        self.undo: List[list] = []
+
+    # make target the innermost scope
+    def enter(self, target: Basic_Block):
+        if self.scope and self.scope[-1] is target:
+            return
+        while self.scope and not self.scope[-1].dominates(target):
+            self.pop()
+        top = self.scope[-1] if self.scope else None
+        path = []
+        bb = target
+        while bb is not None and bb is not top:
+            path.append(bb)
+            bb = bb.idom
+        for bb in reversed(path):
+            self.push(bb)
+
+    def push(self, bb: Basic_Block):
+        undo = []
+        for key, instruction in bb.values.items():
+            undo.append(key)
+            undo.append(self.table.get(key))
+            self.table[key] = instruction
+        self.scope.append(bb)
+        self.undo.append(undo)
+
+    def pop(self):
+        self.scope.pop()
+        undo = self.undo.pop()
+        for i in range(len(undo) - 2, -1, -2):
+            key, instruction = undo[i], undo[i + 1]
+            if instruction is None:
+                del self.table[key]
+            else:
+                self.table[key] = instruction
+
+    def reset(self):
+        self.table = {}
+        self.scope = []
+        self.undo = []
+
+    def lookup(self, key: tuple) -> Instruction:
+        return self.table.get(key)
+
+    def insert(self, target: Basic_Block, key: tuple, instruction: Instruction):
+        if key in target.values:
+            return
+        self.define(target, key, instruction)
+
+    # like insert, a later definition in the same block replaces the earlier one
+    def define(self, target: Basic_Block, key: tuple, instruction: Instruction):
+        target.values[key] = instruction
+        if self.scope and self.scope[-1] is target:
+            self.undo[-1] += (key, self.table.get(key))
+            self.table[key] = instruction
+        elif any(bb is target for bb in self.scope):
+            # value added behind the innermost scope, rebuild on next enter
+            self.reset()
+
+class IR:
+    def __init__(self, diagnostics: Diagnostics = None, symbols: SymbolTable = None, profiler: Profiler = None):
+        # ssa tables and phase events go to the diagnostics sink
+        self.diagnostics: Diagnostics = diagnostics if diagnostics is not None else Diagnostics()
+        # timers and counters, None when profiling is off
+        self.profiler: Profiler = profiler
+        # names of the identifier ids used in ssa tables and kill instructions
+        self.symbols: SymbolTable = symbols if symbols is not None else SymbolTable()
         self.bb_list: List[Basic_Block] = []
         self.bb_count: int = 0
         # instruction count
         self.pc: int = 0
+        # const value: instruction id in bb0, and back
+        self.constants: Dict[Any, int] = {}
+        self.constant_values: Dict[int, Any] = {}
+        self.value_table: ValueTable = ValueTable()
+        # load and adda id: array they access, their memory version is looked up again on rewrites
+        self.memory_access: Dict[int, int] = {}
+        # base const name: dimensions, of every array of the program, shared with its functions
+        self.arrays: Dict[str, List[int]] = {}
+        # function symbol id: its ir, only the ir of main has functions
+        self.functions: Dict[int, IR] = {}
+        # symbol id of the function and its parameters, None for main
+        self.name: int = None
+        self.params: List[int] = []
+        self.void: bool = False
+        # loops not sealed yet, innermost last
+        self.loop_stack: List[Loop] = []
+        # blocks enter the dominator tree in preorder
+        # dominator path of the newest block, their subtrees are still open
+        self.dominator_path: List[Basic_Block] = []
+        self.dominator_count: int = 0
+        if profiler is not None:
+            profiler.attach(self)
         # bb0
         self.bb_list.append(Basic_Block(bb_id=0))
+        self.addDominator(self.bb_list[0], None)
         # bb1
         self.addBB(fall_through=True)
+        self.addDominator(self.bb_list[1], self.bb_list[0])
     
     def addBB(self, fall_through: bool = False, branch: bool = False, parent: Basic_Block = None):
         if not parent:
             parent = self.bb_list[self.bb_count]
         self.bb_count += 1
         newBB = Basic_Block(self.bb_count)
-        # newBB.ssa_table = parent.ssa_table is shallow copy
-        newBB.ssa_table = {k:v if type(v) == int else v[:] for k,v in parent.ssa_table.items()}
+        # new definitions go to newBB, everything else is resolved through parent
+        newBB.ssa_table = SSATable(parent.ssa_table)
 
         self.bb_list.append(newBB)
+        if self.profiler is not None:
+            self.profiler.count("blocks")
+            if newBB.ssa_table.depth == 0:
+                self.profiler.count("ssa table copies")
+                self.profiler.count("ssa entries copied", len(newBB.ssa_table.definitions))
         if fall_through:
             parent.fall_through = newBB
         if branch:
             parent.branch = newBB
         return newBB
 
-    def toGraph(self):
-        file = open('graph_description', 'w+')
-        file.write('digraph G{\n')
-        for bb in self.bb_list:
-            file.write(bb.instructionToGraph()+'\n')
-        for bb in self.bb_list:
-            if bb.branch:
-                file.write(bb.branchToGraph()+'\n')
-            if bb.fall_through:
-                file.write(bb.fallThroughToGraph()+'\n')
-            # if bb.dominator:
-                # file.write(bb.dominatorToGraph())
-        file.write('}')
-    
+    # write the control flow graph, see GraphEmitter for targets and formats
+    def toGraph(self, target = "graph_description", format: str = DOT, dominators: bool = False) -> GraphEmitter:
+        emitter = GraphEmitter(target, format=format, dominators=dominators)
+        emitter.emit(self)
+        emitter.close()
+        return emitter
+
     def printSSA(self):
+        if not self.diagnostics.enabled(SSA):
+            return
         for bb in self.bb_list:
             # print(bb.bb_id, {k: v for k,v in bb.ssa_table.items() if type(v) == int})
-            print(bb.bb_id, bb.ssa_table)
+            ssa_table = {self.symbols.name(k): v for k,v in bb.ssa_table.items()}
+            self.diagnostics.write(SSA, f'{bb.bb_id} {ssa_table}\n')
 
     # return const instruction id if constant exits
     # else create new constant then return instruction id
     def immediate(self, value:int) -> int:
-        for instruction in self.bb_list[0].instruction_list:
-            if instruction.op_code == "const" and instruction.operant1 == value:
-                return instruction.instruction_id
-        self.bb_list[0].instruction_list.append(Instruction(self.pc, "const", operant1=value))
-        self.pc += 1
-        return self.immediate(value)
+        instruction_id = self.constants.get(value)
+        if instruction_id is None:
+            instruction_id = self.pc
+            self.bb_list[0].instruction_list.append(Instruction(self.pc, "const", operant1=value))
+            self.constants[value] = instruction_id
+            self.constant_values[instruction_id] = value
+            self.pc += 1
+        return instruction_id
 
     # find the identifier int the same bb
     # return instruction id
-    def getIdent(self, id: str, target: Basic_Block = None) -> int:
+    def getIdent(self, id: int, target: Basic_Block = None) -> int:
         if not target:
             target = self.bb_list[self.bb_count]
         # call existing identifier
@@ -148,72 +459,100 @@ class IR:
             return self.getIdent(id, target=target)
 
     # declear new identifier or update identifier
-    def setIdent(self, id:str, instruction_id:int = None, target: Basic_Block = None) -> None:
+    def setIdent(self, id: int, instruction_id = None, target: Basic_Block = None) -> None:
         if not target:
             target = self.bb_list[self.bb_count]
         # update identifier or set new identifier
         target.ssa_table[id] = instruction_id
 
+    # array entries are shared between blocks, a new stored flag is a new entry
+    def setStored(self, id: int, stored: Optional[bool], target: Basic_Block = None) -> None:
+        if not target:
+            target = self.bb_list[self.bb_count]
+        entry = target.ssa_table[id]
+        target.ssa_table[id] = ArrayEntry(entry.base_addr, entry.dimension, stored)
+
     # add instruction to current bb
-    def addInstruction(self, op_code: str, operant1 = None, operant2 = None, target: Basic_Block = None):
+    # array_id: array addressed by an adda, indexed for the loads that follow
+    def addInstruction(self, op_code: str, operant1 = None, operant2 = None, target: Basic_Block = None, array_id = None):
         if target is None:
             target = self.bb_list[self.bb_count]
 
         # Common Subexpression Elimination
-        # Exclude phi
-        if op_code != "phi" and op_code != "kill":
-            for dominator in target.dominator:
-                for instruction in dominator.instruction_list:
-                    if instruction.op_code == op_code and instruction.operant1 == operant1 and instruction.operant2 == operant2:
-                        return instruction
-        
+        # Exclude phi, kill and control flow
+        numbered = op_code not in unnumbered_operators
+        if numbered:
+            key = (op_code, operant1, operant2)
+            self.value_table.enter(target)
+            instruction = self.value_table.lookup(key)
+            if self.profiler is not None:
+                self.profiler.count("cse hits" if instruction is not None else "cse misses")
+            if instruction is not None:
+                return instruction
+        elif op_code == "phi" and self.profiler is not None:
+            self.profiler.count("phis created")
+
         instruction = Instruction(self.pc, op_code, operant1, operant2)
         target.instruction_list.append(instruction)
         self.pc += 1
+        if numbered:
+            self.value_table.insert(target, key, instruction)
+            if array_id is not None:
+                self.indexMemory(array_id, instruction, target)
+        elif op_code == "kill":
+            self.value_table.enter(target)
+            self.value_table.define(target, ("kill", operant1), instruction)
         return instruction
     
+    # latest kill of array_id visible at the end of target, None if never killed
+    # loads and addas are indexed under this version, a kill starts a new one
+    def memoryVersion(self, array_id, target: Basic_Block):
+        self.value_table.enter(target)
+        kill = self.value_table.lookup(("kill", array_id))
+        return kill.instruction_id if kill is not None else None
+
+    # make a load or adda of array_id available to later accesses of the same version
+    def indexMemory(self, array_id, instruction: Instruction, target: Basic_Block):
+        key = (instruction.op_code, instruction.operant1, instruction.operant2, self.memoryVersion(array_id, target))
+        self.value_table.insert(target, key, instruction)
+        self.memory_access[instruction.instruction_id] = array_id
+
     def addLoadInstruction(self, array_id, operant=None, target: Basic_Block = None):
         if target is None:
             target = self.bb_list[self.bb_count]
-        # search the closest dominator then the most distant
-        kill_flag = False
-        for dominator in target.dominator:
-            for instruction in reversed(dominator.instruction_list):
-                # search no further beyond kill instruction in the nearest dominator bb
-                if instruction.op_code == "kill" and instruction.operant1 == array_id:
-                    kill_flag = True
-                    break
-                if instruction.op_code == "load" and instruction.operant1 == operant:
-                    return instruction
-            if kill_flag:
-                break
+        # a load is redundant until the next kill of the array
+        key = ("load", operant, None, self.memoryVersion(array_id, target))
+        instruction = self.value_table.lookup(key)
+        if self.profiler is not None:
+            self.profiler.count("load hits" if instruction is not None else "load misses")
+        if instruction is not None:
+            return instruction
         instruction = Instruction(self.pc, "load", operant1=operant)
         target.instruction_list.append(instruction)
         self.pc += 1
+        self.indexMemory(array_id, instruction, target)
         return instruction
 
     def addAddaInstruction(self, array_id, operant1 = None, operant2 =None, target: Basic_Block = None):
         if target is None:
             target = self.bb_list[self.bb_count]
-        # search the closest dominator then the most distant
-        kill_flag = False
-        for dominator in target.dominator:
-            for instruction in reversed(dominator.instruction_list):
-                # search no further beyond kill instruction in the nearest dominator bb
-                if instruction.op_code == "kill" and instruction.operant1 == array_id:
-                    kill_flag = True
-                    break
-                if instruction.op_code == "adda" and instruction.operant1 == operant1 and instruction.operant2 == operant2:
-                    return instruction
-            if kill_flag:
-                break
+        key = ("adda", operant1, operant2, self.memoryVersion(array_id, target))
+        instruction = self.value_table.lookup(key)
+        if self.profiler is not None:
+            self.profiler.count("adda hits" if instruction is not None else "adda misses")
+        if instruction is not None:
+            return instruction
         instruction = Instruction(self.pc, "adda", operant1=operant1, operant2=operant2)
         target.instruction_list.append(instruction)
         self.pc += 1
+        self.indexMemory(array_id, instruction, target)
+        # visible to plain adda lookups as well
+        self.value_table.insert(target, ("adda", operant1, operant2), instruction)
         return instruction
 
     def addPhi(self, join_bb: Basic_Block, left_bb: Basic_Block, right_bb: Basic_Block):
-        for ident, inst_id in join_bb.ssa_table.items():
+        # variables defined above the branch are the same on both sides
+        for ident in divergentIdents(left_bb.ssa_table, right_bb.ssa_table):
             # if not initialized set to constant 0
             if ident not in left_bb.ssa_table or left_bb.ssa_table[ident] is None:
                 self.getIdent(id=ident, target=left_bb)
@@ -221,44 +560,402 @@ class IR:
                 self.getIdent(id=ident, target=right_bb)
             left_inst_id = left_bb.ssa_table.get(ident, None)
             right_inst_id = right_bb.ssa_table.get(ident, None)
-            if type(left_inst_id) == list:
+            if type(left_inst_id) == ArrayEntry:
                 # join inherit 
-                join_bb.ssa_table[ident] = [left_inst_id[0], left_inst_id[1], left_inst_id[2] or right_inst_id[2]]
+                join_bb.ssa_table[ident] = ArrayEntry(left_inst_id.base_addr, left_inst_id.dimension, mergeStored(left_inst_id.stored, right_inst_id.stored))
                 continue
             if left_inst_id != right_inst_id:
                 join_bb.ssa_table[ident] = self.addInstruction(op_code='phi', operant1=left_inst_id, operant2=right_inst_id, target=join_bb).instruction_id
 
-    def reserveWhilePhi(self, loop_header_bb: Basic_Block, ssa_table_ahead):
-        for ident, inst_id in loop_header_bb.ssa_table.items():
-            # if not initialized set to constant 0
-            left_inst_id = loop_header_bb.ssa_table.get(ident, None)
-            right_inst_id = ssa_table_ahead.get(ident, None)
-            if type(left_inst_id) == list:
-                loop_header_bb.ssa_table[ident] = [left_inst_id[0], left_inst_id[1], left_inst_id[2] or right_inst_id[2]]
-                break
-            if left_inst_id != right_inst_id:
-                # set operant2 to identifier to search later
-                loop_header_bb.ssa_table[ident] = self.addInstruction(op_code='phi', operant1=left_inst_id, operant2=ident, target=loop_header_bb).instruction_id
+    # enter a loop: a phi for every variable, operant2 is filled in by updateWhilePhi
+    # whether the loop stores an array is unknown yet, kills emitted meanwhile are pending
+    def reserveWhilePhi(self, loop_header_bb: Basic_Block):
+        loop = Loop(loop_header_bb, self.loop_stack[-1] if self.loop_stack else None)
+        for ident, inst_id in list(loop_header_bb.ssa_table.items()):
+            if type(inst_id) == ArrayEntry:
+                loop.entry_stored[ident] = inst_id.stored
+                if inst_id.stored is not True:
+                    self.setStored(ident, None, target=loop_header_bb)
+                continue
+            if inst_id is None:
+                continue
+            phi = self.addInstruction(op_code='phi', operant1=inst_id, operant2=None, target=loop_header_bb)
+            loop.phis.append((phi, ident))
+            loop_header_bb.ssa_table[ident] = phi.instruction_id
+        self.loop_stack.append(loop)
+
+    # kill emitted while the stored flag depends on an unsealed loop
+    def addPendingKill(self, array_id: int, kill: Instruction, target: Basic_Block = None):
+        if target is None:
+            target = self.bb_list[self.bb_count]
+        self.loop_stack[-1].pending_kills.setdefault(array_id, []).append((target, kill))
+
+    # array stored in the current loop
+    def markStored(self, array_id: int):
+        if self.loop_stack:
+            self.loop_stack[-1].stored.add(array_id)
 
+    # seal the loop once the back edge is known
+    # complete the header phis, remove the trivial ones and resolve pending kills
     def updateWhilePhi(self, loop_header_bb: Basic_Block, loop_body_bb: Basic_Block):
-         for phi in loop_header_bb.instruction_list:
-            if phi.op_code != 'phi':
-                break
-            ident = phi.operant2
+        loop = self.loop_stack.pop()
+        for phi, ident in loop.phis:
             phi.operant2 = loop_body_bb.ssa_table[ident]
+        removed = self.resolvePendingKills(loop)
+        # blocks of the loop, created in dominator tree preorder
+        region = self.bb_list[loop_header_bb.bb_id:]
+        replace = self.removeTrivialPhis(region)
+        if self.profiler is not None:
+            self.profiler.count("loops sealed")
+            self.profiler.count("trivial phis removed", len(replace))
+        # removed kills merge memory versions, accesses are indexed again
+        if replace or removed:
+            self.rewriteRegion(region, replace)
+
+    # return True if kills were removed
+    def resolvePendingKills(self, loop: Loop) -> bool:
+        removed = False
+        parent = loop.parent
+        if parent is not None:
+            parent.stored |= loop.stored
+        for ident, entry_stored in loop.entry_stored.items():
+            pending = loop.pending_kills.get(ident, [])
+            if entry_stored is True:
+                continue
+            if ident in loop.stored:
+                # stored by a previous iteration, the kills stay
+                stored = True
+            elif entry_stored is None:
+                # still up to the enclosing loop
+                if pending:
+                    parent.pending_kills.setdefault(ident, []).extend(pending)
+                stored = None
+            else:
+                for bb, kill in pending:
+                    bb.instruction_list.remove(kill)
+                    removed = True
+                stored = False
+            self.setStored(ident, stored, target=loop.header)
+        return removed
+
+    # phi is trivial if it merges one value, possibly with itself
+    # return removed phi id: value replacing it
+    def removeTrivialPhis(self, region: List[Basic_Block]) -> Dict[int, int]:
+        replace = {}
+        phis = [instruction for bb in region for instruction in bb.instruction_list if instruction.op_code == 'phi']
+        changed = True
+        while changed:
+            changed = False
+            for phi in phis:
+                if phi.instruction_id in replace:
+                    continue
+                values = {findReplacement(replace, phi.operant1), findReplacement(replace, phi.operant2)}
+                values.discard(phi.instruction_id)
+                if len(values) == 1:
+                    replace[phi.instruction_id] = values.pop()
+                    changed = True
+        for bb in region:
+            bb.instruction_list = [instruction for instruction in bb.instruction_list if instruction.instruction_id not in replace]
+        return replace
 
+    # apply replacements to a sealed loop, then merge instructions that became equal
+    def rewriteRegion(self, region: List[Basic_Block], replace: Dict[int, int]):
+        for bb in region:
+            bb.values = {}
+        self.value_table.reset()
+        for bb in region:
+            self.value_table.enter(bb)
+            instruction_list = []
+            for instruction in bb.instruction_list:
+                self.rewriteOperants(bb, instruction, replace)
+                if instruction.op_code in renumbered_operators:
+                    key = (instruction.op_code, instruction.operant1, instruction.operant2)
+                    existing = self.value_table.lookup(key)
+                    if existing is not None:
+                        replace[instruction.instruction_id] = existing.instruction_id
+                        continue
+                    self.value_table.insert(bb, key, instruction)
+                    if instruction.instruction_id in self.memory_access:
+                        self.indexMemory(self.memory_access[instruction.instruction_id], instruction, bb)
+                elif instruction.op_code == "kill":
+                    self.value_table.define(bb, ("kill", instruction.operant1), instruction)
+                elif instruction.op_code == "load":
+                    self.indexMemory(self.memory_access[instruction.instruction_id], instruction, bb)
+                elif instruction.op_code not in unnumbered_operators and instruction.op_code not in ("load", "read", "write", "writeNL"):
+                    self.value_table.insert(bb, (instruction.op_code, instruction.operant1, instruction.operant2), instruction)
+                instruction_list.append(instruction)
+            bb.instruction_list = instruction_list
+        # phis refer forward along the back edge, tables refer to any of them
+        for bb in region:
+            for instruction in bb.instruction_list:
+                self.rewriteOperants(bb, instruction, replace)
+            for ident, inst_id in list(bb.ssa_table.definitions.items()):
+                if type(inst_id) == int:
+                    bb.ssa_table[ident] = findReplacement(replace, inst_id)
+
+    def rewriteOperants(self, bb: Basic_Block, instruction: Instruction, replace: Dict[int, int]):
+        op_code = instruction.op_code
+        # kill names an array, const holds a number, call a function and arg a parameter index
+        if op_code == "kill" or op_code == "const" or op_code == "call" or op_code == "arg":
+            return
+        # a removed branch target moves to the first instruction left in the target block
+        if op_code == "bra":
+            if instruction.operant1 in replace and bb.branch:
+                instruction.operant1 = self.firstInstructionId(bb.branch, instruction.operant1)
+            return
+        instruction.operant1 = findReplacement(replace, instruction.operant1)
+        if op_code in branch_operators:
+            if instruction.operant2 in replace and bb.branch:
+                instruction.operant2 = self.firstInstructionId(bb.branch, instruction.operant2)
+            return
+        instruction.operant2 = findReplacement(replace, instruction.operant2)
+
+    # attach target_bb below its immediate dominator
+    # blocks are created in dominator tree preorder, so closing the subtrees that
+    # target_bb leaves is enough to keep the numbering valid
     def addDominator(self, target_bb: Basic_Block, dominator_bb: Basic_Block):
-        for bb in dominator_bb.dominator:
-            # the closest dominator in the front, the distant dominator in the back
-            target_bb.dominator.append(bb)
+        target_bb.idom = dominator_bb
+        if dominator_bb is not None:
+            dominator_bb.dom_children.append(target_bb)
+        path = self.dominator_path
+        while path and path[-1] is not dominator_bb:
+            path.pop().last = self.dominator_count - 1
+        if dominator_bb is not None and not path:
+            # not in preorder, number the whole tree again
+            self.numberDominatorTree()
+            return
+        target_bb.pre = self.dominator_count
+        target_bb.last = None
+        self.dominator_count += 1
+        path.append(target_bb)
+
+    # preorder numbering of the whole dominator tree, every subtree closed
+    def numberDominatorTree(self):
+        count = 0
+        stack = [(self.bb_list[0], False)]
+        while stack:
+            bb, done = stack.pop()
+            if done:
+                bb.last = count - 1
+                continue
+            bb.pre = count
+            count += 1
+            stack.append((bb, True))
+            for child in reversed(bb.dom_children):
+                stack.append((child, False))
+        self.dominator_count = count
+        self.dominator_path = []
+
+    # immediate dominators from the control flow graph, Cooper, Harvey and Kennedy
+    # for passes that change the graph after parsing
+    def computeDominators(self):
+        entry = self.bb_list[0]
+        # reverse postorder from the entry
+        postorder = []
+        visited = {id(entry)}
+        stack = [(entry, iter(self.successors(entry)))]
+        while stack:
+            bb, children = stack[-1]
+            for child in children:
+                if id(child) not in visited:
+                    visited.add(id(child))
+                    stack.append((child, iter(self.successors(child))))
+                    break
+            else:
+                stack.pop()
+                postorder.append(bb)
+        order = {id(bb): number for number, bb in enumerate(postorder)}
+        predecessors = {id(bb): [] for bb in postorder}
+        for bb in postorder:
+            for child in self.successors(bb):
+                predecessors[id(child)].append(bb)
+        idom = {id(entry): entry}
+        changed = True
+        while changed:
+            changed = False
+            for bb in reversed(postorder):
+                if bb is entry:
+                    continue
+                new_idom = None
+                for predecessor in predecessors[id(bb)]:
+                    if id(predecessor) not in idom:
+                        continue
+                    if new_idom is None:
+                        new_idom = predecessor
+                        continue
+                    # intersect
+                    finger1, finger2 = predecessor, new_idom
+                    while finger1 is not finger2:
+                        while order[id(finger1)] < order[id(finger2)]:
+                            finger1 = idom[id(finger1)]
+                        while order[id(finger2)] < order[id(finger1)]:
+                            finger2 = idom[id(finger2)]
+                    new_idom = finger1
+                if idom.get(id(bb)) is not new_idom:
+                    idom[id(bb)] = new_idom
+                    changed = True
+        for bb in self.bb_list:
+            bb.idom = None
+            bb.dom_children = []
+            bb.pre = -1
+            bb.last = None
+        for bb in reversed(postorder):
+            if bb is not entry:
+                bb.idom = idom[id(bb)]
+                bb.idom.dom_children.append(bb)
+        self.numberDominatorTree()
+        self.value_table.reset()
 
+    # this ir followed by the ir of every function, in declaration order
+    def withFunctions(self) -> List["IR"]:
+        return [self] + list(self.functions.values())
+
+    def successors(self, bb: Basic_Block) -> List[Basic_Block]:
+        return [child for child in (bb.fall_through, bb.branch) if child is not None]
+
+    # first instruction executed when entering bb, empty blocks fall through to the next one
+    def firstInstructionId(self, bb: Basic_Block, default = None):
+        seen = set()
+        while bb is not None and id(bb) not in seen:
+            if bb.instruction_list:
+                return bb.instruction_list[0].instruction_id
+            seen.add(id(bb))
+            bb = bb.fall_through
+        return default
+
+    # predecessors of every block in phi operant order
+    # the block entering with an unconditional bra gives operant2, the other one operant1
+    def predecessors(self) -> Dict[int, List[Basic_Block]]:
+        predecessors = {id(bb): [] for bb in self.bb_list}
+        for bb in self.bb_list:
+            for child in self.successors(bb):
+                predecessors[id(child)].append(bb)
+        for blocks in predecessors.values():
+            if len(blocks) == 2 and endsWithBra(blocks[0]):
+                blocks.reverse()
+        return predecessors
+
+    # loops of the control flow graph as (header, blocks of the loop in block order), innermost first
+    # a back edge goes to a block dominating its source, the dominators must be current
+    def naturalLoops(self) -> List[Tuple[Basic_Block, List[Basic_Block]]]:
+        predecessors = self.predecessors()
+        loops = {}
+        for bb in self.bb_list:
+            for child in self.successors(bb):
+                if not child.dominates(bb):
+                    continue
+                header, body = loops.setdefault(id(child), (child, {id(child): child}))
+                stack = [bb]
+                while stack:
+                    block = stack.pop()
+                    if id(block) not in body:
+                        body[id(block)] = block
+                        stack.extend(predecessors[id(block)])
+        order = {id(bb): position for position, bb in enumerate(self.bb_list)}
+        result = [(header, sorted(body.values(), key=lambda bb: order[id(bb)])) for header, body in loops.values()]
+        result.sort(key=lambda loop: len(loop[1]))
+        return result
+
+    # the block entering the loop of header, its only successor is header
+    # the block falling into header from outside becomes it when it has no other successor,
+    # otherwise a new block is put on that edge
+    # None when the loop is entered from more than one block or by a bra
+    def preheader(self, header: Basic_Block, blocks: List[Basic_Block]) -> Optional[Basic_Block]:
+        inside = {id(bb) for bb in blocks}
+        outside = [bb for bb in self.predecessors()[id(header)] if id(bb) not in inside]
+        if len(outside) != 1 or outside[0].fall_through is not header:
+            return None
+        entry = outside[0]
+        last = entry.instruction_list[-1].op_code if entry.instruction_list else None
+        if entry.branch is None and last not in ("bra", "end", "ret") and last not in branch_operators:
+            return entry
+        preheader = Basic_Block(0)
+        preheader.ssa_table = SSATable(entry.ssa_table)
+        preheader.fall_through = header
+        entry.fall_through = preheader
+        self.bb_list.insert(self.bb_list.index(header), preheader)
+        for bb_id, bb in enumerate(self.bb_list):
+            bb.bb_id = bb_id
+        self.bb_count = len(self.bb_list) - 1
+        return preheader
+
+    # drop blocks the entry cannot reach, the others are numbered again in their order
+    # phis of a join that lost one side keep the value of the other side
+    # predecessors: taken before edges were removed, they give the phi operant order
+    # return the number of blocks removed
+    def removeUnreachable(self, predecessors: Dict[int, List[Basic_Block]] = None) -> int:
+        if predecessors is None:
+            predecessors = self.predecessors()
+        reachable = {id(self.bb_list[0])}
+        stack = [self.bb_list[0]]
+        while stack:
+            for child in self.successors(stack.pop()):
+                if id(child) not in reachable:
+                    reachable.add(id(child))
+                    stack.append(child)
+        for bb in self.bb_list:
+            if id(bb) not in reachable:
+                continue
+            blocks = predecessors.get(id(bb), [])
+            live = [id(block) in reachable and bb in self.successors(block) for block in blocks]
+            if len(blocks) == 2 and live.count(True) == 1:
+                for instruction in bb.instruction_list:
+                    if instruction.op_code == "phi":
+                        if live[0]:
+                            instruction.operant2 = instruction.operant1
+                        else:
+                            instruction.operant1 = instruction.operant2
+        removed = len(self.bb_list) - len(reachable)
+        if not removed:
+            return 0
+        self.bb_list = [bb for bb in self.bb_list if id(bb) in reachable]
+        for bb in self.bb_list:
+            if bb.parents is not None:
+                bb.parents = [parent for parent in bb.parents if id(parent) in reachable]
+        for bb_id, bb in enumerate(self.bb_list):
+            bb.bb_id = bb_id
+        self.bb_count = len(self.bb_list) - 1
+        return removed
+
+def endsWithBra(bb: Basic_Block) -> bool:
+    return bool(bb.instruction_list) and bb.instruction_list[-1].op_code == "bra"
+
+# follow replacements until a value that is not replaced
+def findReplacement(replace: Dict[int, int], value):
+    while type(value) == int and value in replace:
+        value = replace[value]
+    return value
 
 class Parser:
-    def __init__(self, filename):
-        self.tokenizer = Tokenizer(filename = filename)
+    def __init__(self, filename, bulk: bool = True, diagnostics: Diagnostics = None, profiler: Profiler = None):
+        # diagnostics are off unless a sink is given
+        self.diagnostics: Diagnostics = diagnostics if diagnostics is not None else Diagnostics()
+        # timers and counters, None when profiling is off
+        self.profiler: Profiler = profiler
+        start = time.perf_counter()
+        # identifier ids of this compilation
+        self.symbols: SymbolTable = SymbolTable()
+        # bulk scans every token up front, otherwise scan one token per call
+        if bulk:
+            self.tokenizer = TokenStream(filename = filename, diagnostics = self.diagnostics, symbols = self.symbols)
+            self.diagnostics.phase("scan", f"{len(self.tokenizer.tokens)} tokens")
+        else:
+            self.tokenizer = Tokenizer(filename = filename, diagnostics = self.diagnostics, symbols = self.symbols)
+        if profiler is not None:
+            profiler.add("scan", time.perf_counter() - start)
+            # a character tokenizer does its work here, during parsing
+            self.tokenizer.getNext = profiler.timed("tokenizer.getNext", self.tokenizer.getNext)
         # current input TOKEN
         self.inputSym = self.tokenizer.getNext()
-        self.ir: IR = IR()
+        self.ir: IR = IR(diagnostics = self.diagnostics, symbols = self.symbols, profiler = profiler)
+        # ir of main, self.ir is the ir of the function being parsed
+        self.program: IR = self.ir
+        # uninitialized variables are instruction 0, a const 0
+        self.program.immediate(0)
+        # scalars of main, functions reach them through a memory slot
+        self.global_scalars: Set[int] = set()
+        # parameters and locals of the function being parsed, None in main
+        self.function_scope: Set[int] = None
 
     # advance to next token
     def next(self):
@@ -271,8 +968,14 @@ class Parser:
             raise Exception
     
     def parse(self):
+        self.diagnostics.phase("parse")
+        start = time.perf_counter()
         self.computation()
-        print("")
+        if self.profiler is not None:
+            self.profiler.add("parse", time.perf_counter() - start)
+        # close the token trace line
+        self.diagnostics.write(TOKEN, "\n")
+        self.diagnostics.phase("parse", f"{len(self.ir.bb_list)} blocks, {self.ir.pc} instructions, {len(self.ir.functions)} functions")
 
     # "main" {varDecl} {funcDecl} "{" statSequence "}" "."
     def computation(self):
@@ -311,60 +1014,127 @@ class Parser:
         self.checkFor(80)
 
     # "(" [ident { "," ident }] ")"
-    def formalParam(self):
+    # return the parameter ids
+    def formalParam(self) -> List[int]:
+        params = []
         # "("
         self.checkFor(50)
         # ident
         if self.inputSym == 61:
+            params.append(self.tokenizer.id)
             self.checkFor(61)
             # ","
             while self.inputSym == 31:
                 self.checkFor(31)
                 # ident
+                params.append(self.tokenizer.id)
                 self.checkFor(61)
         # ")"
         self.checkFor(35)
+        return params
 
+    # [ "void" ] "function" ident formalParam ";" funcBody ";"
+    # the function gets its own ir, parameters are arg instructions in its first block
+    # it sees the arrays of main under the same base const names and the scalars of main through their slots
     def funcDecl(self):
+        void = False
         # ["void"]
         if self.inputSym == 112:
             self.checkFor(112)
+            void = True
         # "function"
         self.checkFor(113)
+        name = self.tokenizer.id
         # ident
         self.checkFor(61)
-        self.formalParam()
+        if name in self.program.functions or name in (INPUT_NUM, OUTPUT_NUM, OUTPUT_NEW_LINE):
+            raise Exception(f"function {self.symbols.name(name)} declared twice")
+        function = IR(diagnostics = self.diagnostics, symbols = self.symbols, profiler = self.profiler)
+        function.name = name
+        function.void = void
+        function.arrays = self.program.arrays
+        # uninitialized variables are instruction 0, a const 0 as in main
+        function.immediate(0)
+        # declared before the body, it may call itself
+        self.program.functions[name] = function
+        # the caller may have stored to any array or slot, the first load of each one is behind a kill
+        base_names = {instruction.instruction_id: instruction.operant1 for instruction in self.program.bb_list[0].instruction_list}
+        for ident, value in list(self.program.bb_list[self.program.bb_count].ssa_table.items()):
+            if isinstance(value, ArrayEntry):
+                base_addr = function.immediate(base_names[value.base_addr])
+                function.setIdent(ident, ArrayEntry(base_addr, value.dimension, True))
+                function.addInstruction("add", "#BASE", base_addr)
+        self.ir = function
+        self.function_scope = set()
+        function.params = self.formalParam()
+        for index, ident in enumerate(function.params):
+            self.function_scope.add(ident)
+            function.setIdent(ident, function.addInstruction("arg", index).instruction_id)
         # ";"
         self.checkFor(70)
         self.funcBody()
         # ";"
         self.checkFor(70)
+        # falling off the end returns nothing
+        last = function.bb_list[function.bb_count].instruction_list
+        if not last or last[-1].op_code != "ret":
+            function.addInstruction("ret")
+        self.ir = self.program
+        self.function_scope = None
+        self.diagnostics.phase("function", f"{self.symbols.name(name)}: {len(function.bb_list)} blocks, {function.pc} instructions")
 
     # typeDecl indent { "," ident } ";"
     def varDecl(self):
         type, dimension_list = self.typeDecl()
+        self.declare(type, dimension_list)
+        while self.inputSym == 31:
+            self.checkFor(31)
+            self.declare(type, dimension_list)
+        self.checkFor(70)
+
+    # ident of a declaration
+    def declare(self, type: str, dimension_list: List[int]):
+        ident = self.tokenizer.id
         self.checkFor(61)
+        if self.function_scope is not None:
+            self.function_scope.add(ident)
+        elif type == "var":
+            self.global_scalars.add(ident)
         if type == "var":
-            self.ir.setIdent(id=self.tokenizer.id, instruction_id=0)
+            self.ir.setIdent(id=ident, instruction_id=0)
         if type == "array":
-            # add array base address to bb0 as const
-            base_addr = self.ir.immediate(value = f'{self.tokenizer.id}_addr')
+            # add array base address to bb0 as const, arrays of a function are named after it
+            name = f'{self.symbols.name(ident)}_addr'
+            if self.ir.name is not None:
+                name = f'{self.symbols.name(self.ir.name)}.{name}'
+            base_addr = self.ir.immediate(value = name)
+            self.ir.arrays[name] = dimension_list
+            # absolute base computed once in the entry block, every access finds it by cse
+            self.ir.addInstruction("add", "#BASE", base_addr)
             # status    stored_flag
             #           False       
             #           True        
-            # in ssa table store [base_addr, dimension_list, stored_flag]
-            self.ir.setIdent(id=self.tokenizer.id, instruction_id = [base_addr, dimension_list, False])
-        while self.inputSym == 31:
-            self.checkFor(31)
-            self.checkFor(61)
-            if type == "var":
-                self.ir.setIdent(id=self.tokenizer.id, instruction_id=0)
-            if type == "array":
-                # add array base address to bb0 as const
-                base_addr = self.ir.immediate(value = f'{self.tokenizer.id}_addr')
-                # in ssa table store [base_addr, dimension_list, stored_flag, killed_flag]
-                self.ir.setIdent(id=self.tokenizer.id, instruction_id = [base_addr, dimension_list, False])
-        self.checkFor(70)
+            # in ssa table store ArrayEntry(base_addr, dimension_list, stored_flag)
+            # arrays of a function keep what the previous call stored
+            self.ir.setIdent(id=ident, instruction_id = ArrayEntry(base_addr, dimension_list, self.ir.name is not None))
+
+    # memory slot of a main scalar used in a function, a one element array named after it
+    # made on the first use, main keeps the scalar in memory from then on and every call kills it
+    # the function finds the slot in its entry block, later functions get it with the arrays
+    def globalSlot(self, ident: int) -> ArrayEntry:
+        entry = self.ir.bb_list[self.ir.bb_count].ssa_table.get(ident)
+        if isinstance(entry, ArrayEntry):
+            return entry
+        name = f'{self.symbols.name(ident)}_addr'
+        if name not in self.program.arrays:
+            base_addr = self.program.immediate(value = name)
+            self.program.arrays[name] = [1]
+            self.program.addInstruction("add", "#BASE", base_addr)
+            self.program.setIdent(id=ident, instruction_id = ArrayEntry(base_addr, [1], False))
+        # the caller may have stored to it
+        entry = ArrayEntry(self.ir.immediate(value = name), [1], True)
+        self.ir.setIdent(id=ident, instruction_id = entry, target=self.ir.bb_list[0])
+        return entry
 
     # "var" |   "array" "[" number "]" { "[" number "]" }
     def typeDecl(self):
@@ -422,28 +1192,7 @@ class Parser:
             self.ifStatement()
         # "while"
         elif self.inputSym == 103:
-            # snapshot current status
-            position = self.tokenizer.snapshot()
-            pc = self.ir.pc
-            bb = self.ir.bb_count
-            ssa_table_ahead = self.whileStatement(preRun=True)
-            # recover status
-            self.tokenizer.rewind(position)
-            # clear const instructions in bb0
-            new_bb0_list = []
-            for instruction in self.ir.bb_list[0].instruction_list:
-                # the first instruction that exceeds pc
-                if pc <= instruction.instruction_id < self.ir.pc:
-                    continue
-                else:
-                    new_bb0_list.append(instruction)
-            self.ir.bb_list[0].instruction_list = new_bb0_list
-            self.ir.bb_list = self.ir.bb_list[:bb+1]
-            self.ir.pc = pc
-            self.ir.bb_count = bb
-            self.next()
-            # actual run of the while statement
-            self.whileStatement(preRun=False, ssa_table_ahead=ssa_table_ahead)
+            self.whileStatement()
         # "return"
         elif self.inputSym == 104:
             self.returnStatement()
@@ -458,33 +1207,55 @@ class Parser:
         if type == "var":
             self.ir.setIdent(id = var, instruction_id = val)
         if type == "array":
-            base_addr = operant[0]
-            dimension = operant[1]
+            base_addr = operant.base_addr
+            dimension = operant.dimension
             # set stored_flag
-            operant[2] = True
-            offset_sum = None
-            for idx, dim in enumerate(idx_table):
-                if idx == 0:
-                    offset_sum = dim
-                    continue
-                offset_sum =  self.ir.addInstruction("mul", operant1=offset_sum, operant2=dimension[idx]).instruction_id
-                offset_sum =  self.ir.addInstruction("add", operant1=offset_sum, operant2=dim).instruction_id
-            off_set = self.ir.addInstruction("mul", operant1=offset_sum, operant2=self.ir.immediate(4)).instruction_id
+            self.ir.setStored(var, True)
+            self.ir.markStored(var)
+            off_set = self.elementOffset(var, dimension, idx_table)
             base_addr = self.ir.addInstruction("add", "#BASE", base_addr).instruction_id
-            addr = self.ir.addInstruction("adda", operant1=base_addr, operant2=off_set).instruction_id
+            addr = self.ir.addInstruction("adda", operant1=base_addr, operant2=off_set, array_id=var).instruction_id
             self.ir.addInstruction("store", operant1=addr, operant2=val).instruction_id
 
+    # byte offset of an element, the sum of index * stride over the indices
+    # strides are consts of the pool, the terms of constant indices add up to one const
+    def elementOffset(self, array_id: int, dimension: List[int], indices: List[int]) -> int:
+        if len(indices) > len(dimension):
+            raise Exception(f"{self.symbols.name(array_id)} has {len(dimension)} dimensions, {len(indices)} indices given")
+        strides = []
+        stride = 4
+        for length in reversed(dimension):
+            strides.append(stride)
+            stride *= length
+        strides.reverse()
+        offset = None
+        constant = 0
+        for index, stride in zip(indices, strides):
+            value = self.ir.constant_values.get(index)
+            if type(value) == int:
+                constant += value * stride
+                continue
+            term = self.ir.addInstruction("mul", index, self.ir.immediate(stride)).instruction_id
+            offset = term if offset is None else self.ir.addInstruction("add", offset, term).instruction_id
+        if offset is None:
+            return self.ir.immediate(constant)
+        if constant:
+            offset = self.ir.addInstruction("add", offset, self.ir.immediate(constant)).instruction_id
+        return offset
+
     # "call" ident [ "(" [expression { "," expression } ] ")" ]
     def funcCall(self):
         self.checkFor(101)
         function_name = self.tokenizer.id
+        if function_name not in (INPUT_NUM, OUTPUT_NUM, OUTPUT_NEW_LINE):
+            return self.userCall(function_name)
         function_instruction = None
-        if function_name == "InputNum":
+        if function_name == INPUT_NUM:
             function_instruction = Instruction(instruction_id=-1, op_code="read")
-        elif function_name == "OutputNum":
+        elif function_name == OUTPUT_NUM:
             # reserve instruction
             function_instruction = Instruction(instruction_id=-1, op_code="write", operant1=None)
-        elif function_name == "OutputNewLine":
+        elif function_name == OUTPUT_NEW_LINE:
             function_instruction = Instruction(instruction_id=-1, op_code="writeNL")
         self.checkFor(61)
         # function with parentheses
@@ -504,11 +1275,40 @@ class Parser:
                     self.expression()
                 # matching closing parenthese
             self.checkFor(35)
-            function_instruction.instruction_id = self.ir.pc
-            self.ir.bb_list[self.ir.bb_count].instruction_list.append(function_instruction)
-            self.ir.pc += 1
-        # function without parentheses, no parameters allowed
+        # function without parentheses, no parameters allowed, still called
+        if function_name == OUTPUT_NUM and function_instruction.operant1 is None:
+            raise Exception("OutputNum takes 1 argument, 0 given")
+        function_instruction.instruction_id = self.ir.pc
+        self.ir.bb_list[self.ir.bb_count].instruction_list.append(function_instruction)
+        self.ir.pc += 1
         return function_instruction.instruction_id
+
+    # call of a declared function, one param per argument right before the call
+    # the callee may store to any array, loads after the call see a new memory version
+    def userCall(self, function_name: int) -> int:
+        function = self.program.functions.get(function_name)
+        if function is None:
+            raise Exception(f"call of undeclared function {self.symbols.name(function_name)}")
+        self.checkFor(61)
+        arguments = []
+        if self.inputSym == 50:
+            self.checkFor(50)
+            if self.inputSym in [60, 61, 50, 101]:
+                arguments.append(self.expression())
+                while self.inputSym == 31:
+                    self.checkFor(31)
+                    arguments.append(self.expression())
+            self.checkFor(35)
+        if len(arguments) != len(function.params):
+            raise Exception(f"{self.symbols.name(function_name)} takes {len(function.params)} arguments, {len(arguments)} given")
+        for argument in arguments:
+            self.ir.addInstruction("param", argument)
+        call = self.ir.addInstruction("call", function_name, len(arguments))
+        for ident, value in list(self.ir.bb_list[self.ir.bb_count].ssa_table.items()):
+            if isinstance(value, ArrayEntry):
+                self.ir.setStored(ident, True)
+                self.ir.markStored(ident)
+        return call.instruction_id
     
     # "if" relation "then" statSequence [ "else" statSequence ] "fi"
     # create a branch bb, a fall through bb, a join bb
@@ -544,7 +1344,6 @@ class Parser:
             #  BUG FIX NUMBERING IF NEXT INSTRUCTION CONSTANT
             fall_through_bb.instruction_list[-1].operant1 = self.ir.pc
             self.ir.addPhi(join_bb, branch_bb, fall_through_bb)
-            self.ir.addDominator(branch_bb, parent_bb)
         # no else
         else:
             join_bb = self.ir.addBB(branch=True, parent=fall_through_bb)
@@ -558,16 +1357,14 @@ class Parser:
         self.checkFor(82)
 
     # "while" relateion "do" statSequence "od"
-    def whileStatement(self, preRun = False, ssa_table_ahead = {}):
+    # single pass, header phis are sealed once the loop body is parsed
+    def whileStatement(self):
+        self.checkFor(103)
         # upstream bb and loop header
         base_bb = self.ir.bb_list[self.ir.bb_count]
         loop_header = self.ir.addBB(fall_through=True, parent=base_bb)
-        if preRun:
-            self.checkFor(103)
-            # basically do nothing in preRun
-            ssa_table_ahead = loop_header.ssa_table
-        self.ir.reserveWhilePhi(loop_header, ssa_table_ahead)
         self.ir.addDominator(loop_header, base_bb)
+        self.ir.reserveWhilePhi(loop_header)
         while_branch_instruction = self.relation()
         # fall-through loop body
         self.checkFor(42)
@@ -576,17 +1373,13 @@ class Parser:
         self.statSequence()
         loop_body = self.ir.bb_list[self.ir.bb_count]
         loop_body.branch = loop_header
-        self.ir.addInstruction('bra', operant1=loop_header.instruction_list[0].instruction_id, target=loop_body)
-        # self.ir.addPhi(loop_header, loop_body, loop_header)
         # follow
         self.checkFor(81)
-        if not preRun:
-            self.ir.updateWhilePhi(loop_header, loop_body)
+        self.ir.updateWhilePhi(loop_header, loop_body)
+        self.ir.addInstruction('bra', operant1=loop_header.instruction_list[0].instruction_id, target=loop_body)
         while_branch_instruction.operant2 = self.ir.pc
         follow_bb = self.ir.addBB(branch=True, parent=loop_header)
         self.ir.addDominator(follow_bb, loop_header)
-        if preRun:
-            return loop_body.ssa_table
     
     # "return" [ expression ]
     def returnStatement(self):
@@ -596,14 +1389,23 @@ class Parser:
         # = number
         # = "("...
         # = funcCall = "call"...
+        value = None
         if self.inputSym in [60, 61, 50, 101]:
-            self.expression()
+            value = self.expression()
+        self.ir.addInstruction("ret", value)
 
     # ident { "[" expression "]" }
     # if called from assignment, read = false
     # called elsewhere, read = True
     # combination read var, write var, read array, write array
+    # a main scalar with a memory slot is element 0 of it, read and written like an array
     def designator(self, read: bool = True):
+        ident = self.tokenizer.id
+        if ident in self.global_scalars and (self.function_scope is None or ident not in self.function_scope):
+            slot = self.ir.getIdent(ident) if self.function_scope is None else self.globalSlot(ident)
+            if isinstance(slot, ArrayEntry):
+                self.checkFor(61)
+                return slot, "array", [self.ir.immediate(0)]
         operant = None
         if read:
             # get token from current block ssa table
@@ -633,21 +1435,18 @@ class Parser:
             # find identifier in current block ssa or parent block ssa
             operant, type, idx_table = self.designator()
             if type == "array":
-                base_addr = operant[0]
-                dimension = operant[1]
-                # if stored in potential path
-                if operant[2] == True:
+                base_addr = operant.base_addr
+                dimension = operant.dimension
+                # if stored in potential path, None if a loop around may store
+                # the index expressions may have killed the array already
+                stored = self.ir.getIdent(array_id).stored
+                if stored is not False:
                     # reset stored_flag
-                    self.ir.bb_list[self.ir.bb_count].ssa_table[array_id][2] = False
-                    self.ir.addInstruction("kill", operant1=array_id)
-                offset_sum = None
-                for idx, dim in enumerate(idx_table):
-                    if idx == 0:
-                        offset_sum = dim
-                        continue
-                    offset_sum = self.ir.addInstruction("mul", operant1=offset_sum, operant2=dimension[idx]).instruction_id
-                    offset_sum = self.ir.addInstruction("add", operant1=offset_sum, operant2=dim).instruction_id
-                off_set = self.ir.addInstruction("mul", operant1=offset_sum, operant2=self.ir.immediate(4)).instruction_id
+                    self.ir.setStored(array_id, False)
+                    kill = self.ir.addInstruction("kill", operant1=array_id)
+                    if stored is None:
+                        self.ir.addPendingKill(array_id, kill)
+                off_set = self.elementOffset(array_id, dimension, idx_table)
                 base_addr = self.ir.addInstruction("add", "#BASE", base_addr).instruction_id
                 addr = self.ir.addAddaInstruction(array_id=array_id, operant1=base_addr, operant2=off_set).instruction_id
                 operant = self.ir.addLoadInstruction(array_id=array_id, operant=addr).instruction_id
@@ -709,21 +1508,81 @@ class Parser:
         else:
             raise Exception
         operant2 = self.expression()
-        self.ir.addInstruction("cmp", operant1, operant2)
-        return self.ir.addInstruction(branch_map[op_code], self.ir.pc-1, None)
+        # the compare may be an earlier one found by cse
+        compare = self.ir.addInstruction("cmp", operant1, operant2)
+        return self.ir.addInstruction(branch_map[op_code], compare.instruction_id, None)
+
+# ir of a source file, taken from cache when given and the source was compiled before
+def compileFile(filename: str, diagnostics: Diagnostics = None, cache: "ir_cache.IRCache" = None, profiler: Profiler = None) -> IR:
+    if diagnostics is None:
+        diagnostics = Diagnostics()
+    source = None
+    if cache is not None:
+        with open(filename, "rb") as file:
+            source = file.read()
+        start = time.perf_counter()
+        ir = cache.get(source, diagnostics)
+        if profiler is not None:
+            profiler.add("cache lookup", time.perf_counter() - start)
+        if ir is not None:
+            if profiler is not None:
+                profiler.count("cache hits")
+                ir.profiler = profiler
+                profiler.attach(ir)
+            diagnostics.phase("cache", f"hit, {len(ir.bb_list)} blocks, {ir.pc} instructions")
+            return ir
+        diagnostics.phase("cache", "miss")
+    parser = Parser(filename, diagnostics=diagnostics, profiler=profiler)
+    parser.parse()
+    if cache is not None:
+        cache.put(source, parser.ir)
+    return parser.ir
 
 def main():
-    if len(sys.argv) == 2:
-        filename = sys.argv[1]
-        # raise Exception
-    else:
-        filename = "sample0"
+    argument_parser = argparse.ArgumentParser(description="compile a SMPL source into a graph description")
+    argument_parser.add_argument("filename", nargs="?", default="sample0")
+    # diagnostics are off unless asked for
+    argument_parser.add_argument("--trace", choices=list(level_names), default="off", help="diagnostics level")
+    argument_parser.add_argument("--trace-file", default=None, help="write diagnostics to a file instead of stdout")
+    argument_parser.add_argument("--graph", default="graph_description", help="graph output path, - for stdout")
+    argument_parser.add_argument("--graph-format", choices=formats, default=DOT)
+    argument_parser.add_argument("--dominators", action="store_true", help="add dominator tree edges to the graph")
+    argument_parser.add_argument("--cache", default=None, help="directory of the compiled ir cache")
+    argument_parser.add_argument("--cache-size", type=int, default=64 << 20, help="cache size bound in bytes")
+    argument_parser.add_argument("--profile", action="store_true", help="report compiler timers and counters on stderr")
+    argument_parser.add_argument("-O", "--optimize", action="store_true", help="run the default optimization passes")
+    argument_parser.add_argument("--passes", default=None, help="comma separated optimization passes to run, in order")
+    argument_parser.add_argument("--registers", type=int, default=None, help="allocate this many registers after the passes")
+    argument_parser.add_argument("--allocation", default=None, help="allocated ir listing path, - for stdout")
+    argument_parser.add_argument("--allocation-graph", default=None, help="register coloured graph path, - for stdout")
+    args = argument_parser.parse_args()
+    diagnostics = Diagnostics(level_names[args.trace], target=args.trace_file if args.trace_file else sys.stdout)
     # pass filename as argument
-    parser = Parser(filename)
-    # parser = Parser("source_code_input")
-    parser.parse()
-    parser.ir.toGraph()
-    parser.ir.printSSA()
+    cache = ir_cache.IRCache(args.cache, max_bytes=args.cache_size) if args.cache else None
+    profiler = Profiler() if args.profile else None
+    if profiler is not None:
+        profiler.dumpAtExit()
+    ir = compileFile(args.filename, diagnostics=diagnostics, cache=cache, profiler=profiler)
+    if args.passes:
+        optimizer.optimize(ir, args.passes.split(","))
+    elif args.optimize:
+        optimizer.optimize(ir)
+    diagnostics.phase("graph")
+    if args.graph == "-":
+        graph_target = sys.stdout.buffer if args.graph_format == "binary" else sys.stdout
+    else:
+        graph_target = args.graph
+    ir.toGraph(graph_target, format=args.graph_format, dominators=args.dominators)
+    if args.registers is not None:
+        allocation = register_allocation.allocateRegisters(ir, args.registers)
+        for path, text in ((args.allocation, allocation.toString), (args.allocation_graph, allocation.toDot)):
+            if path == "-":
+                sys.stdout.write(text())
+            elif path is not None:
+                with open(path, "w") as file:
+                    file.write(text())
+    ir.printSSA()
+    diagnostics.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+from typing import *
+import smpl_parser
+
+# operators whose value can be linear in an induction variable, an adda adds its offset to the base
+linear_operators = {"add", "sub", "mul", "adda"}
+
+# array address strength reduction, an adda in a loop whose offset is a linear function of an
+# induction variable becomes a pointer phi of the header, starting at the address of the first
+# iteration in the preheader and moved by a constant in the latch
+# the multiplies of the offset are left to dce, pointers of equal addas are shared
+# loops are done innermost first, the start address of an inner loop is an adda of the outer one
+# return counts of replaced addas and of pointers made
+def reduceAddresses(ir) -> Dict[str, int]:
+    replaced, made = carryInductions(ir, "adda")
+    ir.diagnostics.phase("addresses", f"{replaced} addas replaced by {made} pointers")
+    return {"replaced": replaced, "pointers": made}
+
+# induction variable strength reduction, a mul in a loop that is a derived induction variable,
+# a basic one times a const plus values the loop does not change, becomes a phi of the header
+# carrying its value, started in the preheader and increased by a constant in the latch
+# return counts of replaced muls and of phis made
+def reduceMultiplies(ir) -> Dict[str, int]:
+    replaced, made = carryInductions(ir, "mul")
+    ir.diagnostics.phase("induction", f"{replaced} muls replaced by {made} phis")
+    return {"replaced": replaced, "phis": made}
+
+# replace the derived induction variables computed by op_code in every loop by header phis
+# return counts of replaced instructions and of phis made
+def carryInductions(ir, op_code: str) -> Tuple[int, int]:
+    ir.computeDominators()
+    loops = ir.naturalLoops()
+    replace = {}
+    made = 0
+    for header, blocks in loops:
+        induction = inductionVariables(ir, header, blocks)
+        if not induction:
+            continue
+        candidates = [instruction for bb in blocks for instruction in bb.instruction_list
+                      if instruction.op_code == op_code and instruction.instruction_id not in replace]
+        if not candidates:
+            continue
+        preheader = ir.preheader(header, blocks)
+        if preheader is None:
+            continue
+        # the preheader is part of every loop around this one
+        for other_header, other_blocks in loops:
+            if other_blocks is not blocks and any(bb is header for bb in other_blocks) and not any(bb is preheader for bb in other_blocks):
+                other_blocks.append(preheader)
+        predecessors = ir.predecessors()[id(header)]
+        if len(predecessors) != 2 or predecessors[0] is not preheader or not smpl_parser.endsWithBra(predecessors[1]):
+            continue
+        latch = predecessors[1]
+        defined = {instruction.instruction_id: instruction for bb in blocks for instruction in bb.instruction_list}
+        derived = derivedVariables(ir, induction, defined)
+        # (operant1, operant2): phi carrying their value
+        carried = {}
+        for instruction in candidates:
+            key = (instruction.operant1, instruction.operant2)
+            if key not in carried:
+                if instruction.instruction_id not in derived or (op_code == "adda" and instruction.operant1 in defined):
+                    continue
+                phi, scale = derived[instruction.instruction_id]
+                start = cloneValue(ir, instruction.instruction_id, phi, defined, preheader, {})
+                step = ir.immediate(scale * induction[phi])
+                carry = smpl_parser.Instruction(ir.pc, "phi", start)
+                ir.pc += 1
+                following = smpl_parser.Instruction(ir.pc, "add", carry.instruction_id, step)
+                ir.pc += 1
+                carry.operant2 = following.instruction_id
+                phis = sum(1 for other in header.instruction_list if other.op_code == "phi")
+                header.instruction_list.insert(phis, carry)
+                latch.instruction_list.insert(len(latch.instruction_list) - 1, following)
+                if instruction.instruction_id in ir.memory_access:
+                    ir.memory_access[carry.instruction_id] = ir.memory_access[instruction.instruction_id]
+                carried[key] = carry.instruction_id
+                made += 1
+            replace[instruction.instruction_id] = carried[key]
+    if replace:
+        for bb in ir.bb_list:
+            bb.instruction_list = [instruction for instruction in bb.instruction_list if instruction.instruction_id not in replace]
+        for instruction_id in replace:
+            ir.memory_access.pop(instruction_id, None)
+        ir.computeDominators()
+        ir.rewriteRegion(ir.bb_list, replace)
+    return len(replace), made
+
+# basic induction variables of a loop, header phi id: constant step
+# the value along the back edge adds a const to the phi or subtracts one from it
+def inductionVariables(ir, header, blocks) -> Dict[int, int]:
+    defined = {instruction.instruction_id: instruction for bb in blocks for instruction in bb.instruction_list}
+    induction = {}
+    for phi in header.instruction_list:
+        if phi.op_code != "phi":
+            continue
+        update = defined.get(phi.operant2)
+        if update is None:
+            continue
+        left = ir.constant_values.get(update.operant1)
+        right = ir.constant_values.get(update.operant2)
+        if update.op_code == "add" and update.operant1 == phi.instruction_id and type(right) == int:
+            induction[phi.instruction_id] = right
+        elif update.op_code == "add" and update.operant2 == phi.instruction_id and type(left) == int:
+            induction[phi.instruction_id] = left
+        elif update.op_code == "sub" and update.operant1 == phi.instruction_id and type(right) == int:
+            induction[phi.instruction_id] = -right
+    return induction
+
+# derived induction variables of a loop, instruction id: (basic induction phi, factor)
+# an add, sub, mul or adda whose value is the phi times a nonzero const plus values the loop
+# does not change
+# defined: instruction id: instruction of the loop
+def derivedVariables(ir, induction: Dict[int, int], defined: Dict[int, Any]) -> Dict[int, Tuple[int, int]]:
+    derived = {}
+    for phi in induction:
+        scales = {}
+        for instruction_id, instruction in defined.items():
+            if instruction.op_code in linear_operators and instruction_id not in derived:
+                scale = linearScale(ir, instruction_id, phi, defined, scales)
+                if scale:
+                    derived[instruction_id] = (phi, scale)
+    return derived
+
+# factor of phi in value when value is phi times it plus something the loop does not change
+# 0 for values not depending on phi, None when the loop computes value some other way
+# defined: instruction id: instruction of the loop
+def linearScale(ir, value, phi: int, defined: Dict[int, Any], scales: Dict[int, Optional[int]]) -> Optional[int]:
+    if value == phi:
+        return 1
+    instruction = defined.get(value)
+    if instruction is None:
+        return 0
+    if value in scales:
+        return scales[value]
+    scales[value] = None
+    op_code = instruction.op_code
+    if op_code in linear_operators:
+        left = linearScale(ir, instruction.operant1, phi, defined, scales)
+        right = linearScale(ir, instruction.operant2, phi, defined, scales)
+        if left is None or right is None:
+            scale = None
+        elif op_code == "add" or op_code == "adda":
+            scale = left + right
+        elif op_code == "sub":
+            scale = left - right
+        elif left == 0 and right == 0:
+            scale = 0
+        elif type(ir.constant_values.get(instruction.operant2)) == int:
+            scale = left * ir.constant_values[instruction.operant2]
+        elif type(ir.constant_values.get(instruction.operant1)) == int:
+            scale = right * ir.constant_values[instruction.operant1]
+        else:
+            scale = None
+        scales[value] = scale
+    return scales[value]
+
+# value computed again at the end of preheader with phi taking its value on entry
+# return the id of the copy, values from outside the loop are their own copy
+def cloneValue(ir, value, phi: int, defined: Dict[int, Any], preheader, copies: Dict[int, int]) -> int:
+    if value == phi:
+        return defined[phi].operant1
+    instruction = defined.get(value)
+    if instruction is None:
+        return value
+    if value not in copies:
+        left = cloneValue(ir, instruction.operant1, phi, defined, preheader, copies)
+        right = cloneValue(ir, instruction.operant2, phi, defined, preheader, copies)
+        constants = (ir.constant_values.get(left), ir.constant_values.get(right))
+        if instruction.op_code != "adda" and all(type(constant) == int for constant in constants):
+            copies[value] = ir.immediate(smpl_parser.evaluate(instruction.op_code, *constants))
+        else:
+            copy = smpl_parser.Instruction(ir.pc, instruction.op_code, left, right)
+            ir.pc += 1
+            preheader.instruction_list.append(copy)
+            if value in ir.memory_access:
+                ir.memory_access[copy.instruction_id] = ir.memory_access[value]
+            copies[value] = copy.instruction_id
+    return copies[value]
@@ -0,0 +1,37 @@
+from typing import *
+
+# predefined functions are interned first, their ids never change
+INPUT_NUM = 0
+OUTPUT_NUM = 1
+OUTPUT_NEW_LINE = 2
+predefined = ["InputNum", "OutputNum", "OutputNewLine"]
+
+# identifier interning table, one per compilation
+# each name gets a dense integer id, lookup is O(1) both ways
+class SymbolTable:
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+        for name in predefined:
+            self.intern(name)
+
+    # return the id of name, assign the next id on first sight
+    def intern(self, name: str) -> int:
+        id = self.ids.get(name)
+        if id is None:
+            id = len(self.names)
+            self.ids[name] = id
+            self.names.append(name)
+        return id
+
+    # id of an interned name, None if never seen
+    def lookup(self, name: str) -> Optional[int]:
+        return self.ids.get(name)
+
+    def name(self, id: int) -> Optional[str]:
+        if 0 <= id < len(self.names):
+            return self.names[id]
+        return None
+
+    def __len__(self):
+        return len(self.names)
@@ -1,3 +1,8 @@
+import re
+from array import array
+from diagnostics import TOKEN
+from symbol_table import SymbolTable
+
 digit = set([chr(i+48) for i in range(10)])
 # lower case only
 letter = set([chr(i+97) for i in range(26)] + [chr(i+65) for i in range(26)])
@@ -45,13 +50,6 @@ token_table = {
     # "eof": 255
 }
 
-# new id of identifier = len(ident) + 1
-ident = {
-    "InputNum":0,
-    "OutputNum":1,
-    "OutputNewLine":2
-}
-
 class FileReader():
     def __init__(self, filename):
         self.filename = filename
@@ -76,9 +74,53 @@ class FileReader():
         # read text mode
         self.file = open(self.filename, "rt")
 
+    def tell(self):
+        return self.file.tell()
+
+    def seek(self, position):
+        self.file.seek(position)
+
+# load the whole source in one read and walk it by index
+# snapshot and rewind become plain offset saves
+class BufferedReader():
+    def __init__(self, filename):
+        self.filename = filename
+        self.buffer = ""
+        self.length = 0
+        self.position = 0
+        self.BufferedReader()
+
+    def getNext(self):
+        position = self.position
+        if position < self.length:
+            self.position = position + 1
+            return self.buffer[position]
+        # end of file
+        return ""
+
+    def Error(self):
+        raise Exception
+
+    def BufferedReader(self):
+        # read text mode, same newline translation as FileReader
+        with open(self.filename, "rt") as file:
+            self.buffer = file.read()
+        self.length = len(self.buffer)
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position):
+        self.position = position
+
 class Tokenizer():
-    def __init__(self, filename = ""): 
-        self.filereader = FileReader(filename)
+    def __init__(self, filename = "", buffered = True, diagnostics = None, symbols = None): 
+        # identifiers are interned, self.id holds the integer id
+        self.symbols = symbols if symbols is not None else SymbolTable()
+        # buffered reader by default, FileReader reads one char per call
+        self.filereader = BufferedReader(filename) if buffered else FileReader(filename)
+        # token trace sink, None when tracing is off
+        self.trace = diagnostics if diagnostics is not None and diagnostics.enabled(TOKEN) else None
         self.inputSym = None
         self.number = None
         self.id = None
@@ -110,7 +152,7 @@ class Tokenizer():
             # TODO
             else:
                 token = 61
-                self.id = word
+                self.id = self.symbols.intern(word)
         elif self.inputSym in ["+","-","*","/","(",")",",","[","]",")","(",";","}","{"]:
             token = token_table[self.inputSym]
             self.next()
@@ -155,29 +197,118 @@ class Tokenizer():
             return 255
         # handling space tab and line change
         else:
-            if self.inputSym == "\n":
-                print()
+            if self.inputSym == "\n" and self.trace:
+                self.trace.newline()
             # advance to next char
             self.next()
             # try to return next token
             return self.getNext()
-        print(token,end=" ")
+        if self.trace:
+            self.trace.token(token)
         return token
     
-    # can't think about elegant variable table solution
     def Id2String(self, id):
-        for k, v in ident:
-            if v == id:
-                return k
-        return None
+        return self.symbols.name(id)
 
     def String2Id(self, name):
-        if name not in ident:
-            ident[name] = len(ident)
-        return ident[name] 
+        return self.symbols.intern(name)
     
     def snapshot(self):
-        return self.filereader.file.tell()
+        return self.filereader.tell()
+
+    def rewind(self, position):
+        self.filereader.seek(position)
+
+# master pattern for the bulk scanner, leading white space is consumed by the match
+# group order is the dispatch order
+# 1 number, 2 word, 3 operator, 4 lone "=" or "!", 5 anything else is skipped
+token_pattern = re.compile(r"\s*(?:([0-9]+)|([A-Za-z][A-Za-z0-9]*)|(==|!=|<=|>=|<-|[-+*/()\[\],;{}<>.])|([=!])|(.))", re.S)
+
+# tokenize the whole buffer in one pass
+# tokens[i], values[i], offsets[i] describe the i-th token
+# same interface as Tokenizer, getNext only advances an index
+class TokenStream():
+    def __init__(self, filename = "", diagnostics = None, symbols = None):
+        # identifiers are interned, self.id holds the integer id
+        self.symbols = symbols if symbols is not None else SymbolTable()
+        self.filereader = BufferedReader(filename)
+        # token trace sink, None when tracing is off
+        self.trace = diagnostics if diagnostics is not None and diagnostics.enabled(TOKEN) else None
+        # token code, 0 marks a malformed operator
+        self.tokens = array("h")
+        # number or identifier id, None for everything else
+        self.values = []
+        # offset of the token in the source
+        self.offsets = array("l")
+        self.position = 0
+        self.inputSym = None
+        self.number = None
+        self.id = None
+        self.scan()
+
+    def scan(self):
+        buffer = self.filereader.buffer
+        append_token = self.tokens.append
+        append_value = self.values.append
+        append_offset = self.offsets.append
+        intern = self.symbols.intern
+        for match in token_pattern.finditer(buffer):
+            group = match.lastindex
+            if group == 5:
+                continue
+            text = match.group(group)
+            if group == 1:
+                append_token(60)
+                append_value(int(text))
+            elif group == 2:
+                token = token_table.get(text, 61)
+                append_token(token)
+                append_value(intern(text) if token == 61 else None)
+            elif group == 3:
+                append_token(token_table[text])
+                append_value(None)
+            else:
+                append_token(0)
+                append_value(None)
+            append_offset(match.start(group))
+        # eof
+        append_token(255)
+        append_value(None)
+        append_offset(len(buffer))
+
+    # get next input token
+    def getNext(self):
+        position = self.position
+        token = self.tokens[position]
+        if token == 60:
+            self.number = self.values[position]
+        elif token == 61:
+            self.id = self.values[position]
+        elif token == 0:
+            raise Exception
+        elif token == 255:
+            return token
+        self.position = position + 1
+        if self.trace:
+            self.traceToken(position)
+        return token
+
+    # same trace as Tokenizer, line breaks in front of the token then the token
+    def traceToken(self, position):
+        start = self.offsets[position - 1] + 1 if position else 0
+        for _ in range(self.filereader.buffer.count("\n", start, self.offsets[position])):
+            self.trace.newline()
+        self.trace.token(self.tokens[position])
+
+    def Id2String(self, id):
+        return self.symbols.name(id)
+
+    def String2Id(self, name):
+        return self.symbols.intern(name)
+
+    # index of the next token
+    def snapshot(self):
+        return self.position
 
     def rewind(self, position):
-        self.filereader.file.seek(position)
\ No newline at end of file
+        self.position = position
@@ -0,0 +1,337 @@
+import sys
+import time
+import argparse
+from typing import *
+import smpl_parser
+import optimizer
+import register_allocation
+
+# vm operators, the ir operators that execute plus the ones lowering adds
+# moves copies the phi values of one edge, jump and halt replace the fall through
+ADD, SUB, MUL, DIV, CMP, ADDA, LOAD, STORE, READ, WRITE, WRITENL, END, JUMP, MOVES, HALT, CALL, RET, \
+    BNE, BEQ, BLE, BLT, BGE, BGT = range(23)
+vm_operators = {"add": ADD, "sub": SUB, "mul": MUL, "div": DIV, "cmp": CMP, "adda": ADDA, "load": LOAD, "store": STORE,
+                "read": READ, "write": WRITE, "writeNL": WRITENL, "end": END, "ret": RET,
+                "bne": BNE, "beq": BEQ, "ble": BLE, "blt": BLT, "bge": BGE, "bgt": BGT}
+# executed by lowering or when the program starts, params are read by the call after them
+skipped_operators = {"const", "phi", "kill", "param", "arg"}
+
+# reader over whitespace separated numbers of a text stream, read lazily
+def streamReader(stream) -> Callable[[], int]:
+    pending = []
+
+    def read() -> int:
+        while not pending:
+            line = stream.readline()
+            if not line:
+                raise Exception("input exhausted")
+            pending.extend(reversed(line.split()))
+        return int(pending.pop())
+    return read
+
+# reader handing out the numbers of an iterable
+def listReader(numbers: Iterable[int]) -> Callable[[], int]:
+    iterator = iter(numbers)
+
+    def read() -> int:
+        for number in iterator:
+            return number
+        raise Exception("input exhausted")
+    return read
+
+# byte address of every array base const name, placed one after another from "#BASE" in the order
+# they were declared, and the words they take
+# the arrays of the functions are static, they are laid out with the ones of main
+def arrayLayout(ir) -> Tuple[Dict[str, int], int]:
+    addresses = {}
+    words = 0
+    for name, dimension in ir.arrays.items():
+        size = 1
+        for length in dimension:
+            size *= length
+        addresses[name] = words * 4
+        words += size
+    return addresses, words
+
+# executes an ir, lowered once to a flat array of (operator, destination, operant, operant)
+# every value has a register indexed by its instruction id, consts are loaded before the start
+# "#BASE" is address 0, arrays follow one another in memory and addresses count bytes, 4 per word
+# indices are not checked, memory past the arrays reads 0 until something is stored there
+# a phi takes operant2 on the edge from a block ending with bra and operant1 on the other one,
+# lowering turns the phis of a block into one move per incoming edge
+# functions are lowered after main, a call runs the callee on a fresh copy of its registers
+# and its ret writes the value into the destination of the call, ret in main stops like end
+# reader: called for every read, writer: called with the text of every write
+# allocation: a register_allocation.Allocation of main, its values then live in the registers and
+# spill slots and the phis are its sequential moves, functions keep a register per instruction id
+class VM:
+    def __init__(self, ir, reader: Callable[[], int] = None, writer: Callable[[str], Any] = None, allocation = None):
+        self.reader = reader if reader is not None else streamReader(sys.stdin)
+        self.writer = writer if writer is not None else sys.stdout.write
+        self.addresses, self.memory_words = arrayLayout(ir)
+        self.memory: List[int] = [0] * self.memory_words
+        self.code: List[tuple] = []
+        # function symbol id: (entry, register template, (parameter index, register) of its args)
+        self.functions: Dict[int, tuple] = {}
+        self.steps = 0
+        self.seconds = 0.0
+        self.registers = self.layoutRegisters(ir, allocation)
+        self.lower(ir)
+        for name, function in ir.functions.items():
+            registers = self.layoutRegisters(function, None)
+            entry = len(self.code)
+            arguments = tuple((instruction.operant1, self.register(instruction.instruction_id))
+                              for instruction in function.bb_list[1].instruction_list if instruction.op_code == "arg")
+            self.lower(function)
+            self.functions[name] = (entry, registers, arguments)
+
+    # registers of ir with its consts loaded, arrays are placed by arrayLayout
+    # allocated locations come first, then one register per instruction id,
+    # the "#BASE" register and one holding 0 for missing operants
+    # register() maps the operants of ir until the next layout
+    def layoutRegisters(self, ir, allocation) -> List[int]:
+        self.allocation = allocation
+        self.offset = allocation.scratch + 1 if allocation is not None else 0
+        self.base_register = self.offset + ir.pc
+        self.zero_register = self.offset + ir.pc + 1
+        registers = [0] * (self.offset + ir.pc + 2)
+        for instruction in ir.bb_list[0].instruction_list:
+            if instruction.op_code != "const":
+                continue
+            value = instruction.operant1
+            if type(value) != int:
+                if value not in self.addresses:
+                    raise Exception(f"no dimensions for array {value}")
+                value = self.addresses[value]
+            registers[self.offset + instruction.instruction_id] = value
+        return registers
+
+    def register(self, operant) -> int:
+        if type(operant) == int:
+            if self.allocation is not None:
+                location = self.allocation.locations.get(operant)
+                if location is not None:
+                    return location
+                if operant not in self.allocation.constants:
+                    return self.zero_register
+            return self.offset + operant
+        if operant == "#BASE":
+            return self.base_register
+        return self.zero_register
+
+    # moves of the phis of bb taken when entering from predecessor, empty without phis
+    def phiMoves(self, predecessor, bb) -> List[tuple]:
+        if self.allocation is not None:
+            moves = self.allocation.moves.get((predecessor.bb_id, bb.bb_id), [])
+            return [(MOVES, (destination,), (self.register(source[1]) if type(source) == tuple else source,), None)
+                    for destination, source in moves]
+        phis = [instruction for instruction in bb.instruction_list if instruction.op_code == "phi"]
+        if not phis:
+            return []
+        second = smpl_parser.endsWithBra(predecessor)
+        sources = tuple(self.register(phi.operant2 if second else phi.operant1) for phi in phis)
+        return [(MOVES, tuple(self.register(phi.instruction_id) for phi in phis), sources, None)]
+
+    # blocks keep their order, a taken branch into phis goes through a stub doing the moves
+    def lower(self, ir):
+        code = self.code
+        labels = {}
+        # code index of a jump: block it goes to
+        patches = []
+        stubs = []
+        for position, bb in enumerate(ir.bb_list):
+            labels[id(bb)] = len(code)
+            following = ir.bb_list[position + 1] if position + 1 < len(ir.bb_list) else None
+            falls = True
+            params = []
+            for instruction in bb.instruction_list:
+                op_code = instruction.op_code
+                if op_code == "param":
+                    params.append(self.register(instruction.operant1))
+                    continue
+                if op_code in skipped_operators:
+                    continue
+                if op_code == "call":
+                    arguments = tuple(params[len(params) - instruction.operant2:])
+                    code.append((CALL, self.register(instruction.instruction_id), instruction.operant1, arguments))
+                    params = []
+                    continue
+                if op_code == "bra":
+                    code.extend(self.phiMoves(bb, bb.branch))
+                    patches.append((len(code), bb.branch))
+                    code.append((JUMP, None, None, None))
+                    falls = False
+                    break
+                operator = vm_operators.get(op_code)
+                if operator is None:
+                    raise Exception(f"cannot execute {op_code}")
+                if op_code in smpl_parser.branch_operators:
+                    moves = self.phiMoves(bb, bb.branch)
+                    if moves:
+                        stubs.append((len(code), moves, bb.branch))
+                    else:
+                        patches.append((len(code), bb.branch))
+                    code.append((operator, None, self.register(instruction.operant1), None))
+                    break
+                code.append((operator, self.register(instruction.instruction_id), self.register(instruction.operant1), self.register(instruction.operant2)))
+                if op_code == "end" or op_code == "ret":
+                    falls = False
+                    break
+            if not falls:
+                continue
+            if bb.fall_through is None:
+                code.append((HALT, None, None, None))
+                continue
+            code.extend(self.phiMoves(bb, bb.fall_through))
+            if bb.fall_through is not following:
+                patches.append((len(code), bb.fall_through))
+                code.append((JUMP, None, None, None))
+        for index, moves, target in stubs:
+            operator, _, condition, _ = code[index]
+            code[index] = (operator, len(code), condition, None)
+            code.extend(moves)
+            patches.append((len(code), target))
+            code.append((JUMP, None, None, None))
+        for index, target in patches:
+            operator, _, condition, _ = code[index]
+            code[index] = (operator, labels[id(target)], condition, None)
+
+    # run from the entry until end or the last block, return the instructions executed
+    # limit: most instructions to execute, checked on jumps and taken branches
+    def run(self, limit: int = None) -> int:
+        code = self.code
+        registers = self.registers
+        functions = self.functions
+        # (registers, return pc, destination) of the callers
+        frames = []
+        memory = self.memory
+        memory_bytes = len(memory) * 4
+        reader = self.reader
+        writer = self.writer
+        if limit is None:
+            limit = float("inf")
+        pc = 0
+        steps = 0
+        start = time.perf_counter()
+        while True:
+            operator, destination, left, right = code[pc]
+            pc += 1
+            steps += 1
+            if operator == ADD or operator == ADDA:
+                registers[destination] = registers[left] + registers[right]
+            elif operator == CMP:
+                left, right = registers[left], registers[right]
+                registers[destination] = (left > right) - (left < right)
+            elif operator >= BNE:
+                value = registers[left]
+                if operator == BNE:
+                    taken = value != 0
+                elif operator == BEQ:
+                    taken = value == 0
+                elif operator == BLT:
+                    taken = value < 0
+                elif operator == BGE:
+                    taken = value >= 0
+                elif operator == BLE:
+                    taken = value <= 0
+                else:
+                    taken = value > 0
+                if taken:
+                    pc = destination
+                    if steps > limit:
+                        break
+            elif operator == MOVES:
+                values = [registers[source] for source in left]
+                for target, value in zip(destination, values):
+                    registers[target] = value
+            elif operator == JUMP:
+                pc = destination
+                if steps > limit:
+                    break
+            elif operator == SUB:
+                registers[destination] = registers[left] - registers[right]
+            elif operator == MUL:
+                registers[destination] = registers[left] * registers[right]
+            elif operator == LOAD:
+                address = registers[left]
+                if address < 0:
+                    raise Exception(f"load from negative address {address}")
+                registers[destination] = memory[address >> 2] if address < memory_bytes else 0
+            elif operator == STORE:
+                address = registers[left]
+                if address < 0:
+                    raise Exception(f"store to negative address {address}")
+                if address >= memory_bytes:
+                    memory.extend([0] * ((address >> 2) + 1 - len(memory)))
+                    memory_bytes = len(memory) * 4
+                memory[address >> 2] = registers[right]
+            elif operator == DIV:
+                left, right = registers[left], registers[right]
+                if right == 0:
+                    raise Exception("division by zero")
+                # truncated toward zero like evaluate
+                quotient = abs(left) // abs(right)
+                registers[destination] = quotient if (left < 0) == (right < 0) else -quotient
+            elif operator == READ:
+                registers[destination] = reader()
+            elif operator == WRITE:
+                writer(f"{registers[left]} ")
+            elif operator == WRITENL:
+                writer("\n")
+            elif operator == CALL:
+                entry, template, arguments = functions[left]
+                callee = template[:]
+                for index, target in arguments:
+                    callee[target] = registers[right[index]]
+                frames.append((registers, pc, destination))
+                registers = callee
+                pc = entry
+            elif operator == RET:
+                if not frames:
+                    break
+                value = registers[left]
+                registers, pc, destination = frames.pop()
+                registers[destination] = value
+            else:
+                break
+        self.seconds += time.perf_counter() - start
+        self.steps += steps
+        if steps > limit:
+            raise Exception(f"instruction limit {limit} reached")
+        return steps
+
+    def instructionsPerSecond(self) -> float:
+        return self.steps / self.seconds if self.seconds else 0.0
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="compile an SMPL program and run it")
+    argument_parser.add_argument("filename")
+    argument_parser.add_argument("-O", "--optimize", action="store_true", help="run the default optimization passes")
+    argument_parser.add_argument("--passes", default=None, help="comma separated optimization passes to run, in order")
+    argument_parser.add_argument("--input", default=None, help="file with the numbers to read, default stdin")
+    argument_parser.add_argument("--registers", type=int, default=None, help="run on this many allocated registers")
+    argument_parser.add_argument("--limit", type=int, default=None, help="most instructions to execute")
+    argument_parser.add_argument("--stats", action="store_true", help="report executed instructions and throughput on stderr")
+    args = argument_parser.parse_args()
+
+    ir = smpl_parser.compileFile(args.filename)
+    if args.passes:
+        optimizer.optimize(ir, args.passes.split(","))
+    elif args.optimize:
+        optimizer.optimize(ir)
+    input_file = open(args.input) if args.input else sys.stdin
+    try:
+        allocation = register_allocation.allocateRegisters(ir, args.registers) if args.registers is not None else None
+        vm = VM(ir, reader=streamReader(input_file), allocation=allocation)
+        vm.run(args.limit)
+    finally:
+        sys.stdout.flush()
+        if args.input:
+            input_file.close()
+    if args.stats:
+        sys.stderr.write(f"{vm.steps} instructions in {vm.seconds:.4f} s, {vm.instructionsPerSecond():.0f} instructions/s, "
+                         f"{len(vm.code)} lowered\n")
+
+
+if __name__ == "__main__":
+    main()